@@ -0,0 +1,480 @@
+"""
+    This file contains the accuracy checks for the faster calculator engines.
+
+    Every engine is run on a set of battles and compared against the float64 calculator, which is the
+    reference, or the float64 forward sweep for sea battles (see REFERENCES). Chances are compared directly, average IPC losses relative to the IPC value of the side
+    that loses them, so both kinds of error are on the same scale.
+
+    accuracy_report runs a few hand picked battles. differential_report runs thousands of random ones,
+    land battles with AA guns, shore bombardment, shuffled loss orders and with or without conquering,
+    and sea battles, through every engine. It also checks the float64 calculator itself against a
+    vectorized Monte Carlo simulation that rolls every unit's dice, written from the rules independently.
+
+    Usage:
+        python accuracy.py --battles 2000 --samples 20000
+"""
+import argparse
+import io
+import sys
+from contextlib import redirect_stdout
+from time import perf_counter
+
+import numpy as np
+
+from troop import Troop, Army, Power, ATTACK_HIT_DIE, DEFENSE_HIT_DIE, LOSS_ORDER_TROOP, TROOP_IPC_VALUE
+from simulator import CasualtyBall, NavalCasualtyBall, land_battle, sea_battle, battle_summary, solve_battle, land_battle_grid, IncrementalBattle
+from anytime import AnytimeBattle
+import calculator
+from calculator import TOLERANCES
+
+FIELDS = ("win", "tie", "loss", "attack_loss", "defense_loss") # every one is checked against calculator.TOLERANCES
+
+# Monte Carlo errors are measured in standard errors of the sample mean instead
+MONTE_CARLO_Z = 5
+
+# (name, attacking power and troops, defending power and troops)
+REPORT_BATTLES = [
+    ("small", (Power.US, {Troop.inf : 2, Troop.tank : 1}), (Power.G, {Troop.inf : 3})),
+    ("mixed", (Power.US, {Troop.inf : 3, Troop.art : 2, Troop.tank : 2, Troop.fighter : 1, Troop.bomber : 1}),
+              (Power.G, {Troop.inf : 5, Troop.art : 1, Troop.tank : 2, Troop.fighter : 1})),
+    ("aa", (Power.UK, {Troop.inf : 4, Troop.fighter : 3, Troop.bomber : 1}), (Power.J, {Troop.inf : 4, Troop.aa : 1})),
+    ("bombard", (Power.US, {Troop.inf : 3, Troop.tank : 1, Troop.cruiser : 1, Troop.battleship : 1}), (Power.G, {Troop.inf : 4, Troop.art : 1})),
+    ("large", (Power.R, {Troop.inf : 15, Troop.art : 5, Troop.tank : 8, Troop.fighter : 3}),
+              (Power.G, {Troop.inf : 18, Troop.art : 4, Troop.tank : 6, Troop.aa : 1})),
+]
+
+def make_army(power, troops):
+    army = Army(power)
+    for troop, cnt in troops.items():
+        army[troop] += cnt
+    return army
+
+def make_balls(attacking_army, defending_army, need_conquer=True, attack_loss_order="IATFB", defense_loss_order="GIABTF"):
+    attack_ball = CasualtyBall(attacking_army, attacker=True, loss_order=attack_loss_order, need_conquer=need_conquer)
+    defense_ball = CasualtyBall(defending_army, attacker=False, loss_order=defense_loss_order, need_conquer=False)
+    return attack_ball, defense_ball
+
+def make_naval_balls(attacking_army, defending_army, attack_loss_order="DFCBKWN", defense_loss_order="DNCFKW"):
+    attack_ball = NavalCasualtyBall(attacking_army, attacker=True, loss_order=attack_loss_order)
+    defense_ball = NavalCasualtyBall(defending_army, attacker=False, loss_order=defense_loss_order)
+    return attack_ball, defense_ball
+
+def quiet(function, *args, **kwargs):
+    # calls function without the timer on calculate_full_battle printing every battle
+    with redirect_stdout(io.StringIO()):
+        return function(*args, **kwargs)
+
+def exact_battle(attacking_army, defending_army, **options):
+    # land_battle with the float64 calculator, without the timer printing every call
+    attack_ball, defense_ball = make_balls(attacking_army, defending_army, **options)
+    states = calculator.calculate_full_battle.__wrapped__(attacking_army, attack_ball, defending_army, defense_ball)
+    return battle_summary(states, attack_ball, defense_ball)
+
+def exact_sea_battle(attacking_army, defending_army, **options):
+    # sea battle with the float64 forward sweep, which shares no code with the calculate_full_battle behind sea_battle
+    attack_ball, defense_ball = make_naval_balls(attacking_army, defending_army, **options)
+    probs = calculator.forward_battle(attacking_army, attack_ball, defending_army, defense_ball, precision="float64")
+    states = {state : float(probs[state]) for state in zip(*np.nonzero(probs))}
+    return battle_summary(states, attack_ball, defense_ball)
+
+# battle kind -> float64 calculator every engine of that kind is compared against. Sea battles use the forward
+# sweep, since the only sea engines are sea_battle, i.e. calculate_full_battle itself, and the backward sweep
+REFERENCES = {
+    "land" : exact_battle,
+    "sea" : exact_sea_battle,
+}
+
+def backward_battle(attacking_army, defending_army, **options):
+    attack_ball, defense_ball = make_balls(attacking_army, defending_army, **options)
+    return solve_battle(attacking_army, attack_ball, defending_army, defense_ball)
+
+def grid_battle(attacking_army, defending_army, **options):
+    # the battle as the corner of a grid with one more infantry on each side, so it shares the bigger battle's sweep
+    grid = land_battle_grid(attacking_army, defending_army, Troop.inf, (attacking_army[Troop.inf], attacking_army[Troop.inf] + 1),
+                            Troop.inf, (defending_army[Troop.inf], defending_army[Troop.inf] + 1), **options)
+    return tuple(grid[0, 0])
+
+def incremental_battle(attacking_army, defending_army, **options):
+    # solves the battle with an infantry less on each side first, then adds them back
+    attack_inf, defense_inf = int(attacking_army[Troop.inf] > 1), int(defending_army[Troop.inf] > 1)
+    start_attack, start_defense = attacking_army + Army(attacking_army.owner), defending_army + Army(defending_army.owner)
+    start_attack[Troop.inf] -= attack_inf
+    start_defense[Troop.inf] -= defense_inf
+    battle = IncrementalBattle(start_attack, start_defense, **options)
+    battle.add_units("attack", Troop.inf, attack_inf)
+    return battle.add_units("defense", Troop.inf, defense_inf)
+
+def anytime_battle(attacking_army, defending_army, **options):
+    # the last estimate, after every stage has run
+    return AnytimeBattle(attacking_army, defending_army, **options).run().result
+
+def sea_backward_battle(attacking_army, defending_army, **options):
+    attack_ball, defense_ball = make_naval_balls(attacking_army, defending_army, **options)
+    return solve_battle(attacking_army, attack_ball, defending_army, defense_ball)
+
+# engine name -> (battle kind, function(attacking_army, defending_army, **options) -> land_battle result)
+ENGINES = {
+    "backward" : ("land", backward_battle),
+    "float32" : ("land", lambda attacking_army, defending_army, **options: land_battle(attacking_army, defending_army, precision="float32", **options)),
+    "log" : ("land", lambda attacking_army, defending_army, **options: land_battle(attacking_army, defending_army, precision="log", **options)),
+    "grid" : ("land", grid_battle),
+    "incremental" : ("land", incremental_battle),
+    "anytime" : ("land", anytime_battle),
+    "sea_battle" : ("sea", lambda attacking_army, defending_army, **options: quiet(sea_battle, attacking_army, defending_army, **options)),
+    "sea_backward" : ("sea", sea_backward_battle),
+}
+
+def result_errors(result, reference, attacking_army, defending_army):
+    # error per field of result against the reference, IPC losses relative to the army's value
+    scales = (1, 1, 1, max(attacking_army.value(), 1), max(defending_army.value(), 1))
+    return [abs(r - ref) / scale for r, ref, scale in zip(result, reference, scales)]
+
+def run_engine(engine, battles):
+    # results of engine on every (attacking_army, defending_army, options) battle, and the seconds it took
+    start = perf_counter()
+    results = [engine(attacking_army, defending_army, **options) for attacking_army, defending_army, options in battles]
+    return results, perf_counter() - start
+
+def error_stats(errors):
+    return (
+        {field : max(error[f] for error in errors) for f, field in enumerate(FIELDS)},
+        {field : sum(error[f] for error in errors) / len(errors) for f, field in enumerate(FIELDS)},
+    )
+
+def accuracy_report(battles=REPORT_BATTLES, precisions=("float32", "log")):
+    """
+        Runs every battle with the float64 calculator and with every engine in precisions.
+
+    Returns:
+        dictionary precision -> {"max_error" : {field : error}, "mean_error" : {field : error},
+                                 "time" : seconds, "reference_time" : seconds, "within_tolerance" : bool}
+    """
+    armies = [(make_army(*attack), make_army(*defense), {}) for _, attack, defense in battles]
+    references, reference_time = run_engine(exact_battle, armies)
+
+    report = {}
+    for precision in precisions:
+        results, elapsed = run_engine(ENGINES[precision][1], armies)
+        errors = [result_errors(result, reference, *battle[:2]) for result, reference, battle in zip(results, references, armies)]
+        max_error, mean_error = error_stats(errors)
+        report[precision] = {
+            "max_error" : max_error,
+            "mean_error" : mean_error,
+            "time" : elapsed,
+            "reference_time" : reference_time,
+            "within_tolerance" : max(max_error.values()) <= TOLERANCES[precision],
+        }
+
+    return report
+
+class SimulatedArmy:
+    """
+        One side of a Monte Carlo battle: how many of every troop are alive in each sample.
+
+        Written straight from the rules, troop by troop, so it shares nothing with the casualty balls it checks.
+        A battleship takes two hits: 'D' in the loss order damages one, 'W' sinks one, damaged ones first.
+    """
+    def __init__(self, army, attacker, loss_order, samples, sea=False, need_conquer=False):
+        hit_die = ATTACK_HIT_DIE if attacker else DEFENSE_HIT_DIE
+        fighting = [Troop.trans, Troop.cruiser, Troop.carrier, Troop.battleship, Troop.fighter, Troop.bomber] if sea \
+            else [Troop.inf, Troop.art, Troop.tank, Troop.aa, Troop.fighter, Troop.bomber]
+        self.troops = [troop for troop in fighting if army[troop] > 0]
+        self.column = {troop : c for c, troop in enumerate(self.troops)}
+        self.counts = np.tile(np.array([army[troop] for troop in self.troops], dtype=np.int64), (samples, 1))
+        self.die = [hit_die[troop] for troop in self.troops]
+        self.values = np.array([TROOP_IPC_VALUE[troop] for troop in self.troops], dtype=np.float64)
+        self.attacker = attacker
+        self.sea = sea
+        self.undamaged = self.counts[:, self.column[Troop.battleship]].copy() if Troop.battleship in self.column else np.zeros(samples, dtype=np.int64)
+        self.loss_order = [LOSS_ORDER_TROOP[c] for c in loss_order if LOSS_ORDER_TROOP[c] in self.column or c == "D"]
+
+        # the attacker keeps its best land troop for last when it wants to take the territory
+        self.mvp = None
+        if need_conquer:
+            self.mvp = next((self.column[troop] for troop in (Troop.tank, Troop.art, Troop.inf) if troop in self.column), None)
+
+    def count(self, troop):
+        return self.counts[:, self.column[troop]] if troop in self.column else 0
+
+    def roll(self, rng):
+        # hits of one round, every attacking artillery lets one infantry hit on a 2
+        supported = np.minimum(self.count(Troop.inf), self.count(Troop.art)) if self.attacker else 0
+        hits = 0
+        for c, troop in enumerate(self.troops):
+            hitters = self.counts[:, c]
+            if troop == Troop.inf:
+                hits = hits + rng.binomial(supported, 2 / 6)
+                hitters = hitters - supported
+            hits = hits + rng.binomial(hitters, self.die[c] / 6)
+        return hits
+
+    def can_hit(self):
+        return sum(self.counts[:, c] for c in range(len(self.troops)) if self.die[c] > 0) > 0
+
+    def alive(self):
+        return self.counts.sum(axis=1) > 0
+
+    def take_casualties(self, hits, air_only=False):
+        """
+            Loses hits troops in every sample, following the loss order. AA guns only hit planes.
+        """
+        hits = np.array(hits, dtype=np.int64)
+        reserved = (self.counts[:, self.mvp] > 0).astype(np.int64) if self.mvp is not None and not air_only else 0
+        for troop in self.loss_order:
+            if troop == Troop.damaged_battleship:
+                damaged = np.minimum(self.undamaged, hits)
+                self.undamaged -= damaged
+                hits -= damaged
+                continue
+            if air_only and troop not in (Troop.fighter, Troop.bomber):
+                continue
+            c = self.column[troop]
+            lost = np.minimum(self.counts[:, c] - (reserved if c == self.mvp else 0), hits)
+            self.counts[:, c] -= lost
+            hits -= lost
+            if troop == Troop.battleship:
+                self.undamaged = np.minimum(self.undamaged, self.counts[:, c]) # damaged ones sink first
+
+        if self.mvp is not None and not air_only:
+            self.counts[:, self.mvp] -= np.minimum(reserved, hits)
+
+    def ipc_left(self):
+        counts = self.counts
+        if self.sea and not self.attacker and Troop.fighter in self.column:
+            # fighters without a carrier to land on are lost after the battle
+            counts = counts.copy()
+            counts[:, self.column[Troop.fighter]] = np.minimum(self.count(Troop.fighter), 2 * self.count(Troop.carrier))
+        return counts @ self.values
+
+def monte_carlo_battle(attacking_army, defending_army, kind="land", samples=20000, seed=None, max_rounds=1000,
+                       need_conquer=True, attack_loss_order=None, defense_loss_order=None):
+    """
+        Plays the battle out samples times at once with numpy, rolling every unit's dice and taking
+        casualties unit by unit. kind is "land" or "sea", loss orders default to those of land_battle or sea_battle.
+
+    Returns:
+        (land_battle result, standard error of every field)
+    """
+    rng = np.random.default_rng(seed)
+    sea = kind == "sea"
+    default_attack_order, default_defense_order = ("DFCBKWN", "DNCFKW") if sea else ("IATFB", "GIABTF")
+    attack = SimulatedArmy(attacking_army, True, attack_loss_order or default_attack_order, samples, sea, need_conquer and not sea)
+    defense = SimulatedArmy(defending_army, False, defense_loss_order or default_defense_order, samples, sea)
+    attack_value, defense_value = attack.counts @ attack.values, defense.counts @ defense.values
+
+    bombard = 0
+    if not sea:
+        # AA guns fire up to 3 shots each at planes before combat, and hit on a 1
+        planes = attacking_army[Troop.fighter] + attacking_army[Troop.bomber]
+        attack.take_casualties(rng.binomial(min(3 * defending_army[Troop.aa], planes), 1 / 6, samples), air_only=True)
+
+        # every land unit can have one ship bombard for it in the first round, battleships first
+        land_units = attacking_army[Troop.inf] + attacking_army[Troop.art] + attacking_army[Troop.tank]
+        battleships = min(attacking_army[Troop.battleship], land_units)
+        cruisers = min(attacking_army[Troop.cruiser], land_units - battleships)
+        bombard = rng.binomial(battleships, ATTACK_HIT_DIE[Troop.battleship] / 6, samples) + rng.binomial(cruisers, ATTACK_HIT_DIE[Troop.cruiser] / 6, samples)
+
+    for _ in range(max_rounds):
+        # a battle is over when a side is gone, or neither side has dice left
+        fighting = attack.alive() & defense.alive() & (attack.can_hit() | defense.can_hit())
+        if not fighting.any():
+            break
+        attack_hits = (attack.roll(rng) + bombard) * fighting
+        defense_hits = defense.roll(rng) * fighting
+        defense.take_casualties(attack_hits)
+        attack.take_casualties(defense_hits)
+        bombard = 0
+
+    # a defender still standing wins, battles still going after max_rounds included
+    attack_alive, defense_alive = attack.alive(), defense.alive()
+    outcomes = np.stack([
+        attack_alive & ~defense_alive,
+        ~attack_alive & ~defense_alive,
+        defense_alive,
+        attack_value - attack.ipc_left(),
+        defense_value - defense.ipc_left(),
+    ], axis=1).astype(np.float64)
+    return tuple(outcomes.mean(axis=0)), outcomes.std(axis=0) / np.sqrt(samples)
+
+def monte_carlo_z(result, reference, standard_error, samples, attacking_army, defending_army):
+    """
+        Error of a Monte Carlo result in standard errors, for every field.
+
+        Rare outcomes often never show up in the samples, so the sample standard error is floored by the
+        standard error the exact chance implies and by a single sample's worth of the field.
+    """
+    scales = (1, 1, 1, max(attacking_army.value(), 1), max(defending_army.value(), 1))
+    z_scores = []
+    for f, (r, ref, se) in enumerate(zip(result, reference, standard_error)):
+        floor = scales[f] / samples
+        if f < 3: # chances
+            floor = max(floor, np.sqrt(max(ref * (1 - ref), 0) / samples))
+        z_scores.append(abs(r - ref) / max(se, floor))
+    return z_scores
+
+def random_battle(rng, max_units=6):
+    """
+        A random land battle. Every troop type shows up: attackers can bring cruisers and battleships
+        to bombard and transports and carriers that take no part, defenders can have AA guns.
+        Both loss orders are shuffled, and the attacker doesn't always need to conquer.
+
+    Returns:
+        (attacking_army, defending_army, land_battle keyword arguments)
+    """
+    attack_power, defense_power = rng.choice(list(Power), 2, replace=False)
+    attacking_army = Army(attack_power)
+    defending_army = Army(defense_power)
+
+    for troop in (Troop.inf, Troop.art, Troop.tank, Troop.fighter, Troop.bomber):
+        if rng.random() < 0.5:
+            attacking_army[troop] += int(rng.integers(1, max_units + 1))
+        if rng.random() < 0.5:
+            defending_army[troop] += int(rng.integers(1, max_units + 1))
+    for troop in (Troop.cruiser, Troop.battleship, Troop.trans, Troop.carrier):
+        if rng.random() < 0.25:
+            attacking_army[troop] += int(rng.integers(1, 3))
+    if rng.random() < 0.3:
+        defending_army[Troop.aa] += int(rng.integers(1, 3))
+
+    # both sides need someone to fight, and the attacker a land unit to conquer with
+    if sum(attacking_army[troop] for troop in (Troop.inf, Troop.art, Troop.tank)) == 0:
+        attacking_army[Troop.inf] += 1
+    if sum(defending_army[troop] for troop in (Troop.inf, Troop.art, Troop.tank, Troop.fighter, Troop.bomber, Troop.aa)) == 0:
+        defending_army[Troop.inf] += 1
+
+    options = {
+        "need_conquer" : bool(rng.random() < 0.75),
+        "attack_loss_order" : "".join(rng.permutation(list("IATFB"))),
+        "defense_loss_order" : "".join(rng.permutation(list("GIABTF"))),
+    }
+    return attacking_army, defending_army, options
+
+def random_sea_order(rng, troops):
+    # a shuffled sea loss order, with the first hit on battleships ('D') somewhere before sinking them ('W')
+    order = list(rng.permutation(list(troops)))
+    order.insert(int(rng.integers(0, order.index("W") + 1)), "D")
+    return "".join(order)
+
+def random_sea_battle(rng, max_units=3):
+    """
+        A random sea battle between two fleets with planes, including ones where neither side
+        has any dice, like transports against transports. Both loss orders are shuffled.
+
+    Returns:
+        (attacking_army, defending_army, sea_battle keyword arguments)
+    """
+    attack_power, defense_power = rng.choice(list(Power), 2, replace=False)
+    attacking_army = Army(attack_power)
+    defending_army = Army(defense_power)
+
+    for troop in (Troop.trans, Troop.cruiser, Troop.carrier, Troop.battleship, Troop.fighter, Troop.bomber):
+        if rng.random() < 0.4:
+            attacking_army[troop] += int(rng.integers(1, max_units + 1))
+        if troop != Troop.bomber and rng.random() < 0.4: # bombers don't defend at sea
+            defending_army[troop] += int(rng.integers(1, max_units + 1))
+
+    if attacking_army.value() == 0:
+        attacking_army[Troop.cruiser] += 1
+    if defending_army.value() == 0:
+        defending_army[Troop.trans] += 1
+
+    options = {
+        "attack_loss_order" : random_sea_order(rng, "NCKWFB"),
+        "defense_loss_order" : random_sea_order(rng, "NCKWF"),
+    }
+    return attacking_army, defending_army, options
+
+def differential_report(count=1000, seed=0, max_units=6, engines=tuple(ENGINES), samples=20000, monte_carlo_count=None, sea_every=4):
+    """
+        Runs count random battles through the float64 calculator and every engine of their kind, and the first
+        monte_carlo_count of them (all by default) through the Monte Carlo simulation. Every sea_every-th
+        battle is a sea battle, 0 leaves them out.
+
+    Returns:
+        dictionary engine -> {"max_error" : {field : error}, "mean_error" : {field : error},
+                              "throughput" : battles per second, "within_tolerance" : bool, "failures" : [battle index]}
+        The Monte Carlo errors are in standard errors, and "float64" holds the reference throughput.
+    """
+    rng = np.random.default_rng(seed)
+    kinds, battles = [], []
+    for idx in range(count):
+        sea = sea_every and idx % sea_every == sea_every - 1
+        kinds.append("sea" if sea else "land")
+        battles.append(random_sea_battle(rng, max(max_units // 2, 1)) if sea else random_battle(rng, max_units))
+
+    start = perf_counter()
+    references = [REFERENCES[kind](attacking_army, defending_army, **options) for kind, (attacking_army, defending_army, options) in zip(kinds, battles)]
+    report = {"float64" : {"throughput" : count / (perf_counter() - start)}}
+
+    for engine in engines:
+        kind, function = ENGINES[engine]
+        indices = [idx for idx in range(count) if kinds[idx] == kind]
+        if not indices:
+            continue
+        results, elapsed = run_engine(function, [battles[idx] for idx in indices])
+        errors = [result_errors(result, references[idx], *battles[idx][:2]) for result, idx in zip(results, indices)]
+        max_error, mean_error = error_stats(errors)
+        failures = [idx for idx, error in zip(indices, errors) if max(error) > TOLERANCES[engine]]
+        report[engine] = {
+            "max_error" : max_error,
+            "mean_error" : mean_error,
+            "throughput" : len(indices) / elapsed,
+            "within_tolerance" : not failures,
+            "failures" : failures,
+        }
+
+    monte_carlo_count = count if monte_carlo_count is None else min(monte_carlo_count, count)
+    if monte_carlo_count > 0:
+        start = perf_counter()
+        z_scores = []
+        for idx in range(monte_carlo_count):
+            attacking_army, defending_army, options = battles[idx]
+            result, standard_error = monte_carlo_battle(attacking_army, defending_army, kinds[idx], samples=samples, seed=(seed, idx), **options)
+            z_scores.append(monte_carlo_z(result, references[idx], standard_error, samples, attacking_army, defending_army))
+        elapsed = perf_counter() - start
+        max_error, mean_error = error_stats(z_scores)
+        failures = [idx for idx, z in enumerate(z_scores) if max(z) > MONTE_CARLO_Z]
+        report["monte_carlo"] = {
+            "max_error" : max_error,
+            "mean_error" : mean_error,
+            "throughput" : monte_carlo_count / elapsed,
+            "within_tolerance" : not failures,
+            "failures" : failures,
+        }
+
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the battle engines against the float64 calculator.")
+    parser.add_argument("--battles", type=int, default=1000, help="number of random battles")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-units", type=int, default=6, help="most units of one type on one side")
+    parser.add_argument("--samples", type=int, default=20000, help="Monte Carlo samples per battle")
+    parser.add_argument("--monte-carlo-battles", type=int, default=None, help="only simulate the first few battles")
+    args = parser.parse_args()
+
+    passed = True
+    for precision, stats in accuracy_report().items():
+        status = "ok" if stats["within_tolerance"] else f"FAILED, tolerance {TOLERANCES[precision]:.0e}"
+        print(f"{precision}: {stats['time']:.3f}s vs {stats['reference_time']:.3f}s for float64, {status}")
+        for field in FIELDS:
+            print(f"    {field:>12} max {stats['max_error'][field]:.2e} mean {stats['mean_error'][field]:.2e}")
+        passed &= stats["within_tolerance"]
+
+    report = differential_report(args.battles, args.seed, args.max_units, samples=args.samples, monte_carlo_count=args.monte_carlo_battles)
+    print(f"\n{args.battles} random battles, float64: {report['float64']['throughput']:.1f} battles/s")
+    for engine, stats in report.items():
+        if engine == "float64":
+            continue
+        tolerance = f"{MONTE_CARLO_Z} standard errors" if engine == "monte_carlo" else f"{TOLERANCES[engine]:.0e}"
+        status = "ok" if stats["within_tolerance"] else f"FAILED on {len(stats['failures'])} battles, tolerance {tolerance}"
+        print(f"{engine}: {stats['throughput']:.1f} battles/s, {status}")
+        for field in FIELDS:
+            print(f"    {field:>12} max {stats['max_error'][field]:.2e} mean {stats['mean_error'][field]:.2e}")
+        passed &= stats["within_tolerance"]
+
+    if not passed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
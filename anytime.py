@@ -0,0 +1,192 @@
+"""
+    This file contains an anytime version of land_battle for interactive callers, like an asyncio web server.
+
+    The battle runs in a worker thread. A fast float32 sweep that drops very unlikely states goes first,
+    then the exact float64 sweep, and an Estimate is published every few state classes along the way.
+    Every estimate carries a bound on its error, so a caller with a latency budget can use whatever
+    is ready when the budget runs out.
+
+    Usage:
+        estimate = await land_battle_async(attack, defense, timeout=0.2)
+        print(estimate.result, estimate.error_bound)
+"""
+import asyncio
+import threading
+from time import perf_counter
+
+import numpy as np
+
+from simulator import CasualtyBall, terminal_values, battle_result
+import calculator
+
+class Estimate:
+    """
+        A battle result and how far it can be from the exact one.
+
+        result is (win_chance, tie_chance, loss_chance, avg_attack_loss, avg_defense_loss) as in land_battle,
+        or None if nothing has been computed yet. Every chance is within error_bound of the exact one,
+        and every average IPC loss within error_bound times the IPC value of that side's combatants.
+    """
+    def __init__(self, result, error_bound, precision, elapsed, exact=False):
+        self.result = result
+        self.error_bound = error_bound
+        self.precision = precision # engine that produced it
+        self.elapsed = elapsed # seconds since the calculation started
+        self.exact = exact
+
+    def __repr__(self):
+        return f"Estimate({self.result}, error_bound={self.error_bound:.2e}, precision={self.precision}, elapsed={self.elapsed:.3f}s)"
+
+class AnytimeBattle:
+    """
+        A land battle whose answer is refined for as long as it's allowed to run.
+
+        Call run in a worker thread and cancel from anywhere else. best always holds the estimate
+        with the smallest error bound so far.
+
+    Args:
+        stages (tuple): (precision, prune) of every sweep in order, see calculator.forward_battle
+        report_interval (float): seconds between published estimates within a sweep
+    """
+    def __init__(self, attacking_army, defense, need_conquer=True, attack_loss_order="IATFB", defense_loss_order="GIABTF",
+                 stages=(("float32", 1e-7), ("float64", 0.0)), report_interval=0.02):
+        if isinstance(defense, list):
+            self.defending_army = sum(defense) # sum all defending armies
+        else:
+            self.defending_army = defense
+        self.attacking_army = attacking_army
+        self.need_conquer = need_conquer
+        self.attack_loss_order = attack_loss_order
+        self.defense_loss_order = defense_loss_order
+        self.stages = stages
+        self.report_interval = report_interval
+
+        self.cancelled = threading.Event()
+        self.lock = threading.Lock()
+        self.best = Estimate(None, 1.0, None, 0.0)
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def estimate(self, states, precision, elapsed, done):
+        """
+            Turns the states of a partial sweep into an Estimate.
+            The result is conditioned on the battle being over, and the probability still fighting
+            (or pruned, which is left in fighting states) bounds how wrong that is.
+        """
+        if precision == "log":
+            states = np.exp(states)
+        totals = np.tensordot(states, self.values, axes=3) # [win, tie, loss, attack IPC left, defense IPC left]
+        resolved = totals[:3].sum()
+        if resolved <= 0:
+            return Estimate(None, 1.0, precision, elapsed)
+
+        result = battle_result(totals / resolved, self.attack_ball, self.defense_ball)
+        unresolved = max(0.0, 1 - resolved)
+        if done and precision == "float64" and unresolved < 1e-9:
+            return Estimate(result, 0.0, precision, elapsed, exact=True) # what's left unresolved is round off
+        error_bound = unresolved + calculator.TOLERANCES.get(precision, 0.0)
+        return Estimate(result, min(error_bound, 1.0), precision, elapsed)
+
+    def publish(self, estimate, callback):
+        with self.lock:
+            improved = estimate.error_bound < self.best.error_bound or (estimate.exact and not self.best.exact)
+            if estimate.result is None or (self.best.result is not None and not improved):
+                return # only ever improve
+            self.best = estimate
+        if callback:
+            callback(estimate)
+
+    def run(self, deadline=None, callback=None):
+        """
+            Refines the estimate until the last sweep is done, the battle is cancelled or perf_counter() passes deadline.
+            callback(Estimate) is called, from this thread, with every improved estimate.
+
+        Returns:
+            best Estimate
+        """
+        start = perf_counter()
+        # the casualty balls and terminal values are built here so creating the battle on an event loop is cheap
+        self.attack_ball = CasualtyBall(self.attacking_army, attacker=True, loss_order=self.attack_loss_order, need_conquer=self.need_conquer)
+        self.defense_ball = CasualtyBall(self.defending_army, attacker=False, loss_order=self.defense_loss_order, need_conquer=False)
+        aa_dice = calculator.aa_shots(self.attacking_army, self.defending_army)
+        self.values = terminal_values(self.attack_ball, self.defense_ball, aa_dice)
+
+        for precision, prune in self.stages:
+            last_report = perf_counter()
+            for states in calculator.forward_classes(self.attacking_army, self.attack_ball, self.defending_army, self.defense_ball, precision, prune):
+                now = perf_counter()
+                if self.cancelled.is_set() or (deadline is not None and now >= deadline):
+                    return self.best
+                if now - last_report >= self.report_interval:
+                    self.publish(self.estimate(states, precision, now - start, done=False), callback)
+                    last_report = now
+            self.publish(self.estimate(states, precision, perf_counter() - start, done=prune == 0), callback)
+
+        return self.best
+
+async def land_battle_async(attacking_army, defense, timeout=None, executor=None, **kwargs):
+    """
+        Runs an AnytimeBattle off the event loop, and returns its best Estimate once it's exact
+        or timeout seconds have passed, whichever comes first.
+        Cancelling the awaiting task cancels the calculation too. kwargs go to AnytimeBattle.
+    """
+    battle = AnytimeBattle(attacking_army, defense, **kwargs)
+    deadline = None if timeout is None else perf_counter() + timeout
+    future = asyncio.get_running_loop().run_in_executor(executor, battle.run, deadline)
+    try:
+        return await asyncio.wait_for(asyncio.shield(future), timeout)
+    except asyncio.TimeoutError:
+        battle.cancel()
+        return battle.best
+    except asyncio.CancelledError:
+        battle.cancel()
+        raise
+
+async def land_battle_updates(attacking_army, defense, timeout=None, executor=None, **kwargs):
+    """
+        Async generator over ever better Estimates of a battle, for a UI that redraws as they come in.
+        Stops after the exact result or once timeout seconds have passed. kwargs go to AnytimeBattle.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    battle = AnytimeBattle(attacking_army, defense, **kwargs)
+    deadline = None if timeout is None else perf_counter() + timeout
+
+    callback = lambda estimate: loop.call_soon_threadsafe(queue.put_nowait, estimate)
+    future = loop.run_in_executor(executor, battle.run, deadline, callback)
+    future.add_done_callback(lambda _: queue.put_nowait(None)) # wakes us up once the worker is done
+    try:
+        while True:
+            remaining = None if deadline is None else max(deadline - perf_counter(), 0)
+            try:
+                estimate = await asyncio.wait_for(queue.get(), remaining)
+            except asyncio.TimeoutError:
+                return
+            if estimate is None:
+                future.result() # raises if the worker failed
+                return
+            yield estimate
+    finally:
+        battle.cancel()
+
+def main():
+    from troop import Troop, Army, Power
+
+    attack = Army(Power.R)
+    attack[Troop.inf] += 40
+    attack[Troop.tank] += 20
+    attack[Troop.fighter] += 5
+    defense = Army(Power.G)
+    defense[Troop.inf] += 50
+    defense[Troop.art] += 10
+    defense[Troop.aa] += 1
+
+    async def show():
+        async for estimate in land_battle_updates(attack, defense, timeout=5, report_interval=0.25):
+            print(estimate)
+
+    asyncio.run(show())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+    This file contains benchmarks for re-solving battles incrementally.
+
+    Every scenario starts from a solved IncrementalBattle, changes a few units and times the update
+    against solving the changed battle from scratch.
+
+    Usage:
+        python benchmark.py
+"""
+from time import perf_counter
+
+from troop import Troop, Power
+from simulator import IncrementalBattle
+from accuracy import make_army
+
+# (name, attacking power and troops, defending power and troops, [(side, troop, change)])
+BENCHMARKS = [
+    ("one more infantry", (Power.R, {Troop.inf : 15, Troop.art : 5, Troop.tank : 8, Troop.fighter : 3}),
+                          (Power.G, {Troop.inf : 18, Troop.art : 4, Troop.tank : 6, Troop.aa : 1}), [("attack", Troop.inf, 1)]),
+    ("one defender lost", (Power.R, {Troop.inf : 15, Troop.art : 5, Troop.tank : 8, Troop.fighter : 3}),
+                          (Power.G, {Troop.inf : 18, Troop.art : 4, Troop.tank : 6, Troop.aa : 1}), [("defense", Troop.inf, -1)]),
+    ("one more tank", (Power.US, {Troop.inf : 20, Troop.art : 5, Troop.tank : 10}),
+                      (Power.J, {Troop.inf : 25, Troop.art : 5, Troop.tank : 5}), [("attack", Troop.tank, 1)]),
+    ("one more fighter", (Power.UK, {Troop.inf : 12, Troop.tank : 6, Troop.fighter : 2}),
+                         (Power.G, {Troop.inf : 15, Troop.tank : 4, Troop.aa : 1}), [("attack", Troop.fighter, 1)]),
+    ("reinforced on both sides", (Power.US, {Troop.inf : 20, Troop.art : 5, Troop.tank : 10}),
+                                 (Power.J, {Troop.inf : 25, Troop.art : 5, Troop.tank : 5}), [("attack", Troop.inf, 2), ("defense", Troop.inf, 2)]),
+]
+
+def benchmark(attack, defense, changes, repeats=3):
+    """
+        Times the changes applied to a solved battle against solving the changed battle fresh.
+
+    Returns:
+        (seconds per incremental update, seconds per fresh solve, share of states reused)
+    """
+    incremental_time, fresh_time, reused = 0, 0, 0
+    for _ in range(repeats):
+        battle = IncrementalBattle(make_army(*attack), make_army(*defense))
+        start = perf_counter()
+        for side, troop, change in changes:
+            battle.add_units(side, troop, change)
+        incremental_time += perf_counter() - start
+        reused += battle.reused
+
+        start = perf_counter()
+        IncrementalBattle(battle.attacking_army, battle.defending_army)
+        fresh_time += perf_counter() - start
+
+    return incremental_time / repeats, fresh_time / repeats, reused / repeats
+
+def main():
+    for name, attack, defense, changes in BENCHMARKS:
+        incremental_time, fresh_time, reused = benchmark(attack, defense, changes)
+        print(f"{name:>26}: {incremental_time * 1000:7.1f}ms vs {fresh_time * 1000:7.1f}ms fresh, "
+              f"{fresh_time / incremental_time:5.1f}x speed up, {reused:.0%} of states reused")
+
+if __name__ == '__main__':
+    main()
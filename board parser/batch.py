@@ -0,0 +1,118 @@
+"""
+    This file contains the batch mode of the board parser.
+
+    Walks a directory of screenshots, finds the units and counts in each one across a process pool,
+    and streams one JSON line per screenshot to an output file. Screenshots already in the output file
+    are skipped, so an interrupted run can simply be started again.
+
+    Usage:
+        python batch.py screenshots/ units.jsonl --workers 8
+"""
+import argparse
+import json
+import os
+from multiprocessing import Pool
+
+import cv2 as cv
+
+from cv import TemplateBank, DigitRecognizer, match_counts
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+PARSER_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# every worker loads the templates once, see init_worker
+_bank = None
+_recognizer = None
+
+def init_worker(template_dir, digits_path):
+    global _bank, _recognizer
+    _bank = TemplateBank(template_dir)
+    _recognizer = DigitRecognizer.load(digits_path)
+
+def parse_screenshot(job):
+    """
+        Decodes and parses a single screenshot inside a worker.
+        Only the small result goes back to the parent, so memory stays bounded by the number of workers.
+        Screenshots that can't be decoded or parsed get an error record instead.
+    """
+    root, rel_path = job
+    img = cv.imread(os.path.join(root, rel_path))
+    if img is None:
+        return {"path" : rel_path, "error" : "could not decode image"}
+
+    try:
+        locs = _bank.match(img)
+        counts = match_counts(img, locs, _recognizer)
+    except Exception as e: # one bad screenshot must not take the whole pool down with it
+        return {"path" : rel_path, "error" : f"{type(e).__name__}: {e}"}
+    return {
+        "path" : rel_path,
+        "units" : {name : [list(unit) for unit in units] for name, units in counts.items() if units}
+    }
+
+def find_screenshots(root):
+    # relative paths of every image below root, in a stable order so reruns visit them the same way
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.relpath(os.path.join(dirpath, filename), root)
+
+def load_done(out_path):
+    """
+        Returns the screenshots already in the output file.
+        A line cut off by an interruption is truncated away so new results start on a fresh line.
+    """
+    done = set()
+    if not os.path.exists(out_path):
+        return done
+
+    with open(out_path, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end != len(data):
+            f.truncate(end)
+
+    for line in data[:end].splitlines():
+        try:
+            done.add(json.loads(line)["path"])
+        except (ValueError, KeyError):
+            continue
+
+    return done
+
+def process_directory(root, out_path, workers=None, template_dir=PARSER_DIR, digits_path=None, chunksize=4):
+    """
+        Parses every screenshot below root into out_path, skipping those already done.
+
+    Returns:
+        number of screenshots parsed by this run
+    """
+    if digits_path is None:
+        digits_path = os.path.join(template_dir, "digits.npz")
+
+    done = load_done(out_path)
+    jobs = ((root, path) for path in find_screenshots(root) if path not in done)
+
+    parsed = 0
+    with open(out_path, "a") as out, Pool(workers, initializer=init_worker, initargs=(template_dir, digits_path), maxtasksperchild=500) as pool:
+        for record in pool.imap_unordered(parse_screenshot, jobs, chunksize=chunksize):
+            out.write(json.dumps(record) + "\n")
+            out.flush() # every finished screenshot survives an interruption
+            parsed += 1
+
+    return parsed
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract unit positions and counts from a directory of screenshots.")
+    parser.add_argument("root", help="directory to search for screenshots")
+    parser.add_argument("out", help="JSON lines file to append results to")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes, defaults to the cpu count")
+    parser.add_argument("--templates", default=PARSER_DIR, help="directory with the unit templates and digits.npz")
+    args = parser.parse_args()
+
+    parsed = process_directory(args.root, args.out, workers=args.workers, template_dir=args.templates)
+    print(f"Parsed {parsed} screenshots into {args.out}")
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,35 @@
+import os
+import sys
+
 import cv2 as cv
 import numpy as np
 from matplotlib import pyplot as plt
 
-import pytesseract
-from pytesseract import image_to_string
-pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
-
-import numpy as np
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from troop import Troop, Power
 
 """
-TODO: Use alpha channel for masking / weight templates
-TODO: Add number recognition
-TODO: Extend algorithm to allow searching for all units at once
 TODO: Add territory detection
 """
 
+POWER_NAMES = { # prefix used for template file names of each power
+    Power.R : "russian",
+    Power.G : "german",
+    Power.UK : "british",
+    Power.J : "japanese",
+    Power.US : "american"
+}
+
+TEMPLATE_TROOPS = [troop for troop in Troop if troop not in (Troop.supported_inf, Troop.damaged_battleship)] # internal troops are never drawn
+
+def template_name(power, troop):
+    # templates are saved as {power}_{troop}.png, e.g. german_inf.png
+    return f"{POWER_NAMES[power]}_{troop.name}"
+
+TEMPLATE_NAMES = {
+    template_name(power, troop) : (power, troop) for power in Power for troop in TEMPLATE_TROOPS
+}
+
 def match_template(img, template_name, do_rgb):
     """
 
@@ -46,71 +61,428 @@ def match_template(img, template_name, do_rgb):
 
     return result
 
+def suppress_matches(scores, labels, threshold, spacing):
+    """
+        Greedily picks match locations in reading order, skipping anything within spacing of an earlier match.
+
+    Args:
+        scores (np.ndarray): best match score at every location
+        labels (np.ndarray): index of the template that got that score
+        threshold (float): minimum score to count as a match
+        spacing (int): how close two matches may be
+
+    Returns:
+        list of (x, y, label) tuples
+    """
+    matches = []
+    skip = set()
+    ys, xs = np.nonzero(scores >= threshold) # only locations beyond our threshold can ever match, in row major order
+    for y, x in zip(ys.tolist(), xs.tolist()):
+        if (x, y) in skip:
+            continue
+        matches.append((x, y, int(labels[y, x])))
+        # now, make sure that we don't look for matches in this area again
+        for y2 in range(y, y + spacing + 1):
+            for x2 in range(x - spacing, x + spacing + 1):
+                skip.add((x2, y2))
+
+    return matches
+
 def match_distinct(img_name, template_names, do_rgb, threshold=0.8, spacing=3):
-    img = cv.imread("full.png")
+    img = cv.imread(img_name)
     if not do_rgb:
         img = cv.cvtColor(img, cv.COLOR_BGR2GRAY)
 
-    results = [match_template(img, name, do_rgb) for name in template_names]
+    results = np.stack([match_template(img, name, do_rgb) for name in template_names])
     locs = {name : [] for name in template_names}
-    skip = set()
 
     if do_rgb: # triple the channels means triple the threshold.
         threshold = 3 * threshold
 
-    H, W = results[0].shape
-    for y in range(H):
-        for x in range(W):
-            if (x, y) in skip:
-                continue
-            max_idx = np.argmax([result[y, x] for result in results])
-            # make sure that the loc is beyond our threshold
-            if results[max_idx][y, x] >= threshold:
-                print(f"Adding to locs {template_names[max_idx]} {x}, {y}")
-                locs[template_names[max_idx]].append((x, y))
-                # now, make sure that we don't look for matches in this area again
-                for y2 in range(y, y + spacing + 1):
-                    for x2 in range(x - spacing, x + spacing + 1):
-                        skip.add((x2, y2))
+    for x, y, idx in suppress_matches(results.max(axis=0), results.argmax(axis=0), threshold, spacing):
+        locs[template_names[idx]].append((x, y))
 
     return locs
 
-def rectangle_locs(img, locs, color, h, w):
-    for pt in locs:
-        cv.rectangle(img, pt, (pt[0] + w, pt[1] + h), color, 1)
+class Template:
+    """
+        A single unit template held in memory: grey, per-channel, and alpha mask versions.
+    """
+    def __init__(self, name, power, troop, image, grey=None):
+        self.name = name
+        self.power = power
+        self.troop = troop
+        if image.ndim == 3 and image.shape[2] == 4: # use the alpha channel to ignore the map showing around the icon
+            self.mask = (image[:, :, 3] > 0).astype(np.uint8)
+            image = image[:, :, :3]
+        else:
+            self.mask = np.ones(image.shape[:2], dtype=np.uint8)
+        self.color = image
+        self.channels = cv.split(image)
+        self.grey = cv.cvtColor(image, cv.COLOR_BGR2GRAY) if grey is None else grey
+        self.h, self.w = self.grey.shape
 
+def centred(values):
+    """
+        Centres values and scales them to unit length, so the dot product of two is their correlation.
+    """
+    values = values.astype(np.float64) - values.mean()
+    return values / max(np.sqrt((values ** 2).sum()), 1e-12)
 
-def main():
-    locs = match_distinct("full.png", ["german_inf", "russian_inf"], do_rgb=False)
-    print(len(locs["german_inf"]), "german infantry found")
-    print(len(locs["russian_inf"]), "russian infantry found")
-    print()
-    img = cv.imread("full.png")
-    rectangle_locs(img, locs["german_inf"], (255, 0, 0), 23, 23)
-    rectangle_locs(img, locs["russian_inf"], (0, 0, 255), 23, 23)
+class TemplateBank:
+    """
+        Loads every unit template once and matches all of them against an image in one batched call.
 
-    cv.imwrite('res_both_grey.png',img)
+        Templates are grouped by troop. Every power draws the same icon for a troop in a different colour,
+        but in grey those only look alike for some powers (the British icons are dark on light), so the full
+        grey image is matched against one averaged template per cluster of similar templates of a troop.
+        A template correlating with a patch at threshold bounds how far the average can be from that patch,
+        so the cluster's own templates are only scored exactly where the average came that close. The colour
+        templates then pick the power at the few locations that pass the threshold, since grey alone mixes up
+        powers with similar shades, such as German and American.
+
+        The templates were cut out of full.png with extract_template. It shows no Japanese units, no Russian
+        carrier or American cruiser, and its only German battleship is covered by a badge, so those templates
+        are still missing and listed in missing.
+    """
+    def __init__(self, template_dir=".", names=None, similarity=0.8):
+        self.templates = {}
+        self.missing = [] # names of templates with no image yet, see extract_template
+        self.similarity = similarity # minimum grey correlation of two templates sharing an averaged template
+        for name in names or TEMPLATE_NAMES:
+            path = os.path.join(template_dir, f"{name}.png")
+            image = cv.imread(path, cv.IMREAD_UNCHANGED) if os.path.exists(path) else None
+            if image is None:
+                self.missing.append(name)
+                continue
+            power, troop = TEMPLATE_NAMES.get(name, (None, None))
+            # decoded straight to grey like match_template does, which rounds differently from cvtColor
+            self.add(Template(name, power, troop, image, cv.imread(path, cv.IMREAD_GRAYSCALE)))
+
+    def add(self, template):
+        """
+            Adds a template to the bank and rebuilds the grouped troop templates.
+        """
+        if self.templates and (template.h, template.w) != self.shape:
+            raise ValueError(f"Template {template.name} is {template.h}x{template.w}, expected {self.shape}")
+        self.templates[template.name] = template
+        self.shape = (template.h, template.w)
+
+        self.groups = {} # troop -> list of templates
+        for t in self.templates.values():
+            self.groups.setdefault(t.troop, []).append(t)
+        self.group_keys = list(self.groups)
+
+        # every template's opaque grey pixels, centred and scaled so a dot product with a centred patch is its correlation
+        self.order = [t for key in self.group_keys for t in self.groups[key]]
+        self.order_group = np.array([g for g, key in enumerate(self.group_keys) for _ in self.groups[key]])
+        self.grey_masks = [t.mask.ravel() > 0 for t in self.order]
+        self.grey_templates = [centred(t.grey.ravel()[mask]) for t, mask in zip(self.order, self.grey_masks)]
+
+        # averaged grey templates of similar looking templates of a troop with the same mask,
+        # and the largest angle between each average and one of its templates
+        clusters = []
+        for idx in range(len(self.order)):
+            for cluster in clusters:
+                first = cluster[0]
+                if (self.order_group[first] == self.order_group[idx] and np.array_equal(self.grey_masks[first], self.grey_masks[idx])
+                        and self.grey_templates[first] @ self.grey_templates[idx] >= self.similarity):
+                    cluster.append(idx)
+                    break
+            else:
+                clusters.append([idx])
+        self.clusters = clusters
+        self.cluster_grey = []
+        self.cluster_mask = []
+        self.cluster_reach = []
+        for cluster in clusters:
+            mask = self.grey_masks[cluster[0]]
+            grey = np.round(np.mean([self.order[idx].grey for idx in cluster], axis=0)).astype(np.uint8)
+            average = centred(grey.ravel()[mask])
+            self.cluster_grey.append(grey)
+            self.cluster_mask.append(None if mask.all() else self.order[cluster[0]].mask) # masked matching is several times slower
+            self.cluster_reach.append(max(np.arccos(np.clip(average @ self.grey_templates[idx], -1, 1)) for idx in cluster))
+
+        # colour templates stacked per group so a patch can be compared against every power at once
+        self.group_color = [np.stack([t.color for t in self.groups[key]]).astype(np.float32) for key in self.group_keys]
+        self.group_color_mask = [np.stack([t.mask for t in self.groups[key]]).astype(np.float32) for key in self.group_keys]
+
+    def correlations(self, grey, ys, xs, members):
+        """
+            Normalized correlation (TM_CCOEFF_NORMED) of the templates at indices members with the patches whose
+            top left corners are at ys, xs, as an array of shape (members, locations). Flat patches correlate with nothing.
+        """
+        h, w = self.shape
+        patches = np.lib.stride_tricks.sliding_window_view(grey, (h, w))[ys, xs].reshape(len(ys), h * w).astype(np.float64)
+        scores = np.zeros((len(members), len(ys)))
+        for row, idx in enumerate(members):
+            values = patches[:, self.grey_masks[idx]]
+            values -= values.mean(axis=1, keepdims=True)
+            norms = np.sqrt((values ** 2).sum(axis=1))
+            scores[row] = np.where(norms > 1e-9, values @ self.grey_templates[idx] / np.maximum(norms, 1e-9), 0.0)
+        return scores
+
+    def match(self, img, threshold=0.8, spacing=3):
+        """
+            Finds every template in the image.
+
+        Args:
+            img (opencv Image): BGR image to match against.
+            threshold (float): minimum normalized correlation of the grey template match.
+            spacing (int): minimum distance between two matches.
+
+        Returns:
+            dictionary from template name to a list of (x, y) locations
+        """
+        locs = {name : [] for name in self.templates}
+        if not self.templates or img.shape[0] < self.shape[0] or img.shape[1] < self.shape[1]:
+            return locs # no room for a single icon
+
+        grey = cv.cvtColor(img, cv.COLOR_BGR2GRAY)
+        best_scores = np.zeros((grey.shape[0] - self.shape[0] + 1, grey.shape[1] - self.shape[1] + 1))
+        best_templates = np.zeros(best_scores.shape, dtype=np.int64)
+        for cluster, template, mask, reach in zip(self.clusters, self.cluster_grey, self.cluster_mask, self.cluster_reach):
+            coarse = cv.matchTemplate(grey, template, cv.TM_CCOEFF_NORMED, mask=mask)
+            if mask is not None: # masked matches on flat areas divide by 0
+                coarse = np.nan_to_num(coarse, nan=0.0, posinf=0.0, neginf=0.0)
+            if len(cluster) == 1: # the average of one template is that template, so its scores are already exact
+                better = coarse > best_scores
+                best_scores[better] = coarse[better]
+                best_templates[better] = cluster[0]
+                continue
+
+            # a patch within the threshold's angle of a template is within that plus the reach of the average,
+            # so the cluster's own templates only need scoring where the average came at least that close
+            bound = np.cos(min(reach + np.arccos(threshold), np.pi)) - 1e-6
+            ys, xs = np.nonzero(coarse >= bound)
+            scores = self.correlations(grey, ys, xs, cluster)
+            for row, idx in enumerate(cluster):
+                better = scores[row] > best_scores[ys, xs]
+                best_scores[ys[better], xs[better]] = scores[row][better]
+                best_templates[ys[better], xs[better]] = idx
+
+        h, w = self.shape
+        for x, y, idx in suppress_matches(best_scores, best_templates, threshold, spacing):
+            group = self.order_group[idx]
+            patch = img[y:y + h, x:x + w].astype(np.float32)
+            colors, masks = self.group_color[group], self.group_color_mask[group]
+            # masked mean squared colour difference against each power's version of this troop
+            diff = ((colors - patch) ** 2).sum(axis=3) * masks
+            best = np.argmin(diff.sum(axis=(1, 2)) / masks.sum(axis=(1, 2)))
+            locs[self.groups[self.group_keys[group]][best].name].append((x, y))
+
+        return locs
+
+ICON_SIZE = 23 # unit icons are 23x23 pixels
+NUMBER_SIZE = 16 # the unit count badge is a 16x16 circle overlapping the bottom right of the icon
+NUMBER_OFFSET = (8, 6) # how far the badge is pulled back into the icon, (x, y)
+GLYPH_SHAPE = (12, 8) # every digit is rescaled to this (h, w) before classification
 
-    # sz_icon = 23
-    # sz_num = 16
-    # i = 0
-    # for pt in german_inf:
-    #     # cv.rectangle(img, pt, (pt[0] + w1, pt[1] + h1), (0,0,255), 2)
-    #     offset_w, offset_h = 8, 6
-    #     x1, y1 = (pt[0] + sz_icon - offset_w         , pt[1] + sz_icon - offset_h)
-    #     x2, y2 = (pt[0] + sz_icon - offset_w + sz_num, pt[1] + sz_icon - offset_h + sz_num)
+def number_box(loc):
+    """
+        Returns the (x1, y1, x2, y2) box of the count badge for a unit icon found at loc.
+    """
+    x1 = loc[0] + ICON_SIZE - NUMBER_OFFSET[0]
+    y1 = loc[1] + ICON_SIZE - NUMBER_OFFSET[1]
+    return x1, y1, x1 + NUMBER_SIZE, y1 + NUMBER_SIZE
+
+def split_glyphs(crop):
+    """
+        Splits a count badge into its digit glyphs, left to right.
+
+        Badges are either a white digit on black or a black digit on yellow, each with a coloured ring,
+        so we look only inside the ring and threshold relative to the badge fill.
+
+    Args:
+        crop (opencv Image): BGR crop of the badge, see number_box
+
+    Returns:
+        list of flattened float32 glyphs of size GLYPH_SHAPE, scaled to [0, 1]
+    """
+    grey = cv.cvtColor(crop, cv.COLOR_BGR2GRAY).astype(np.float32)
+    h, w = grey.shape
+    yy, xx = np.mgrid[:h, :w]
+    inner = (yy - (h - 1) / 2) ** 2 + (xx - (w - 1) / 2) ** 2 <= (min(h, w) / 2 - 2.5) ** 2 # drop the ring
+
+    fill = np.median(grey[inner])
+    if fill < 128: # white digit on a dark badge
+        ink = grey > (fill + 255) / 2
+    else: # dark digit on a yellow badge
+        ink = grey < fill / 2
+    ink = (ink & inner).astype(np.uint8)
+
+    count, _, stats, _ = cv.connectedComponentsWithStats(ink, connectivity=8)
+    glyphs = []
+    for x, y, gw, gh, area in sorted(stats[1:].tolist()): # label 0 is the background, sorted by x
+        if area < 3 or gh < 4: # specks of noise left over from the ring
+            continue
+        glyph = cv.resize(ink[y:y + gh, x:x + gw].astype(np.float32), GLYPH_SHAPE[::-1], interpolation=cv.INTER_AREA)
+        glyphs.append(glyph.ravel())
+
+    return glyphs
+
+class DigitRecognizer:
+    """
+        Nearest-neighbour digit classifier over the fixed font of the unit count badges.
+
+        The prototypes are learnt from labelled badge crops with fit, and saved next to the templates
+        so a screenshot can be read without OCR. Every glyph of a screenshot is classified in a single
+        distance computation.
+
+        The shipped digits.npz only has prototypes for 1 to 4, so a glyph farther than max_distance
+        from every prototype is treated as unknown and its whole badge reads as None rather than
+        as the closest known digit. By default max_distance is the largest distance between a prototype
+        and its nearest prototype of the same digit, i.e. how far apart two readings of one digit get.
+    """
+    def __init__(self, prototypes=None, labels=None, max_distance=None):
+        self.prototypes = np.zeros((0, GLYPH_SHAPE[0] * GLYPH_SHAPE[1]), dtype=np.float32) if prototypes is None else prototypes
+        self.labels = np.zeros(0, dtype=np.int64) if labels is None else labels
+        self.max_distance = max_distance
+
+    @classmethod
+    def load(cls, path="digits.npz"):
+        data = np.load(path)
+        max_distance = float(data["max_distance"]) if "max_distance" in data else None
+        return cls(data["prototypes"], data["labels"], max_distance)
+
+    def save(self, path="digits.npz"):
+        if self.max_distance is None:
+            np.savez(path, prototypes=self.prototypes, labels=self.labels)
+        else:
+            np.savez(path, prototypes=self.prototypes, labels=self.labels, max_distance=self.max_distance)
+
+    def fit(self, crops, counts):
+        """
+            Adds the glyphs of labelled badge crops as prototypes. Crops that don't split into
+            as many glyphs as their label has digits are skipped.
+        """
+        prototypes, labels = [self.prototypes], [self.labels]
+        for crop, count in zip(crops, counts):
+            glyphs = split_glyphs(crop)
+            digits = [int(c) for c in str(count)]
+            if len(glyphs) != len(digits):
+                continue
+            prototypes.append(np.array(glyphs, dtype=np.float32))
+            labels.append(np.array(digits, dtype=np.int64))
+        self.prototypes = np.concatenate(prototypes)
+        self.labels = np.concatenate(labels)
+        return self
+
+    def digits(self):
+        # the digits there are prototypes for, any other digit reads as None
+        return sorted(set(self.labels.tolist()))
+
+    def distances(self, glyphs):
+        """
+            Squared distance of every glyph to every prototype, |a|^2 - 2ab + |b|^2
+        """
+        glyphs = np.asarray(glyphs, dtype=np.float32)
+        dists = (glyphs ** 2).sum(axis=1)[:, None] - 2 * glyphs @ self.prototypes.T + (self.prototypes ** 2).sum(axis=1)[None, :]
+        return np.maximum(dists, 0) # round off can push identical glyphs below 0
+
+    def rejection_distance(self):
+        """
+            Returns max_distance, or the default derived from the prototypes if it isn't set.
+        """
+        if self.max_distance is not None:
+            return self.max_distance
+        dists = self.distances(self.prototypes)
+        np.fill_diagonal(dists, np.inf)
+        same = np.where(self.labels[:, None] == self.labels[None, :], dists, np.inf).min(axis=1)
+        same = same[np.isfinite(same)]
+        return float(same.max()) if len(same) else np.inf # a digit with one prototype says nothing about the spread
 
-    #     num = img[y1:y2, x1:x2]
-    #     cv.imwrite(f"num_{i}.png", num)
-    #     i += 1
+    def read(self, crops):
+        """
+            Reads the unit count of every badge crop at once.
 
-    #     cv.rectangle(img, (x1, y1), (x2, y2), (0,0,255), 1)
+        Returns:
+            list with the count of each crop, or None if no digit was found in it
+            or one of its glyphs is too far from every prototype
+        """
+        glyph_lists = [split_glyphs(crop) for crop in crops]
+        glyphs = [glyph for glyph_list in glyph_lists for glyph in glyph_list]
+        if not glyphs or not len(self.prototypes):
+            return [None] * len(crops)
 
+        dists = self.distances(glyphs)
+        digits = self.labels[dists.argmin(axis=1)].tolist()
+        known = (dists.min(axis=1) <= self.rejection_distance()).tolist()
 
+        counts = []
+        i = 0
+        for glyph_list in glyph_lists:
+            j = i + len(glyph_list)
+            if not glyph_list or not all(known[i:j]):
+                counts.append(None)
+            else:
+                counts.append(int("".join(str(d) for d in digits[i:j])))
+            i = j
 
-    # for pt in russian_inf:
-    #     cv.rectangle(img, pt, (pt[0] + w2, pt[1] + h2), (255,0,0), 2)
+        return counts
+
+def match_counts(img, locs, recognizer):
+    """
+        Reads the unit count next to every location from TemplateBank.match or match_distinct.
+
+        Only counts made of the recognizer's digits can be read. The shipped digits.npz has prototypes
+        for 1 to 4 alone, so with it any count with a 0 or 5 to 9 in it, such as 5 or 10, reads as None.
+        Two digit counts made of 1 to 4 alone, such as 12, still read.
+
+    Returns:
+        dictionary from template name to a list of (x, y, count), count is None if it couldn't be read
+    """
+    H, W = img.shape[:2]
+    counts = {name : [] for name in locs}
+    keys, crops = [], []
+    for name, points in locs.items():
+        for pt in points:
+            x1, y1, x2, y2 = number_box(pt)
+            if x2 > W or y2 > H: # badge is cut off by the edge of the screenshot, the unit is still there
+                counts[name].append((pt[0], pt[1], None))
+                continue
+            keys.append((name, pt))
+            crops.append(img[y1:y2, x1:x2])
+
+    for (name, (x, y)), count in zip(keys, recognizer.read(crops)):
+        counts[name].append((x, y, count))
+
+    return counts
+
+def extract_template(img, loc, name, template_dir=".", size=ICON_SIZE):
+    """
+        Crops a unit icon at loc out of a screenshot and saves it as {name}.png for the TemplateBank.
+    """
+    x, y = loc
+    template = img[y:y + size, x:x + size]
+    cv.imwrite(os.path.join(template_dir, f"{name}.png"), template)
+    return template
+
+def rectangle_locs(img, locs, color, h, w):
+    for pt in locs:
+        cv.rectangle(img, pt, (pt[0] + w, pt[1] + h), color, 1)
+
+
+def main():
+    img = cv.imread("full.png")
+    bank = TemplateBank()
+    locs = bank.match(img)
+    recognizer = DigitRecognizer.load()
+    counts = match_counts(img, locs, recognizer)
+    for name, units in counts.items():
+        if units:
+            print(sum(c or 0 for _, _, c in units), name.replace("_", " "), "found")
+    unread = sum(c is None for units in counts.values() for _, _, c in units)
+    print()
+    print(f"{unread} badges couldn't be read and aren't counted, only digits {recognizer.digits()} are known")
+    print("no template for", ", ".join(bank.missing))
+    for name in locs:
+        rectangle_locs(img, locs[name], (255, 0, 0) if name.startswith("german") else (0, 0, 255), ICON_SIZE, ICON_SIZE)
+        for pt in locs[name]:
+            x1, y1, x2, y2 = number_box(pt)
+            cv.rectangle(img, (x1, y1), (x2, y2), (0, 255, 0), 1)
+
+    cv.imwrite('res_both_grey.png',img)
 
 if __name__ == '__main__':
     main()
-
@@ -0,0 +1,223 @@
+"""
+    This file contains the live pipeline from game screenshots to battle odds.
+
+    screenshot -> unit locations and counts (cv.py) -> Armies per Territory -> land_battle odds
+
+    Consecutive frames are diffed so only territories whose pixels changed are matched again,
+    and only battles whose armies actually changed are recomputed.
+
+    TODO:
+        Detect territory regions from the map instead of passing them in by hand
+"""
+from time import perf_counter
+
+import cv2 as cv
+
+from cv import TemplateBank, DigitRecognizer, TEMPLATE_NAMES, ICON_SIZE, NUMBER_SIZE, match_counts
+from troop import Army
+from simulator import CasualtyBall, battle_summary, army_key
+import calculator
+
+class FrameResult:
+    """
+        What changed in a single frame, and how long each stage took.
+    """
+    def __init__(self):
+        self.changed_territories = []
+        self.updated_armies = {} # territory name -> {power : Army}
+        self.unreadable = {} # territory name -> {power : Army} of updated territories with unreadable badges
+        self.updated_battles = {} # battle index -> land_battle result
+        self.uncertain_battles = [] # indices of updated battles fought with unreadable badges
+        self.timings = {}
+
+class BoardPipeline:
+    """
+        Streams screenshots into battle odds, re-parsing only what changed between frames.
+
+    Args:
+        regions (dict): territory name -> (x, y, w, h) box of that territory on screen
+        battles (list): (attacking power, [attacking territory names], defending territory name) per battle
+        territory_map (map.Map): optional map whose Territory.armies are kept up to date
+        diff_threshold (int): grey level change that counts as a changed pixel
+    """
+    def __init__(self, regions, battles, bank=None, recognizer=None, territory_map=None, diff_threshold=24, need_conquer=True):
+        self.regions = regions
+        self.battles = battles
+        self.bank = bank if bank is not None else TemplateBank()
+        self.recognizer = recognizer if recognizer is not None else DigitRecognizer.load()
+        self.territory_map = territory_map
+        self.diff_threshold = diff_threshold
+        self.need_conquer = need_conquer
+
+        self.prev_grey = None
+        self.armies = {name : {} for name in regions} # territory name -> {power : Army}
+        self.unreadable = {name : {} for name in regions} # territory name -> {power : Army} of units whose badge couldn't be read
+        self.results = {} # battle index -> land_battle result
+        self.uncertain = set() # battle indices whose result only counts unreadable badges as a single unit
+        self.battle_keys = {} # battle index -> army keys the result was computed from
+        self.listeners = []
+
+    def subscribe(self, callback):
+        """
+            callback(FrameResult) is called after every frame that changed any armies.
+        """
+        self.listeners.append(callback)
+
+    def changed_regions(self, grey):
+        """
+            Returns the territories with any pixel that changed since the last frame.
+            Regions are padded so icons and badges hanging over a border are still noticed.
+        """
+        if self.prev_grey is None or self.prev_grey.shape != grey.shape:
+            return list(self.regions)
+
+        changed = cv.absdiff(grey, self.prev_grey) > self.diff_threshold
+        pad = ICON_SIZE + NUMBER_SIZE
+        names = []
+        for name, (x, y, w, h) in self.regions.items():
+            if changed[max(y - pad, 0):y + h + pad, max(x - pad, 0):x + w + pad].any():
+                names.append(name)
+
+        return names
+
+    def parse_region(self, img, name):
+        """
+            Matches units inside one territory and builds an Army per power found there.
+            A unit belongs to the territory its icon's top left corner is in.
+
+        Returns:
+            ({power : Army}, {power : Army}) of the units found, and of those whose count badge couldn't be read.
+            Unreadable badges only count as the single unit they at least are in the first.
+        """
+        x, y, w, h = self.regions[name]
+        x1, y1 = max(x - ICON_SIZE, 0), max(y - ICON_SIZE, 0)
+        crop = img[y1:y + h + ICON_SIZE, x1:x + w + ICON_SIZE]
+
+        locs = {}
+        for template, points in self.bank.match(crop).items():
+            locs[template] = [
+                (px + x1, py + y1) for px, py in points if x <= px + x1 < x + w and y <= py + y1 < y + h
+            ]
+
+        armies = {}
+        unreadable = {}
+        for template, points in match_counts(img, locs, self.recognizer).items():
+            power, troop = TEMPLATE_NAMES[template]
+            for _, _, count in points:
+                if power not in armies:
+                    armies[power] = Army(power)
+                if count is None:
+                    if power not in unreadable:
+                        unreadable[power] = Army(power)
+                    unreadable[power][troop] += 1
+                armies[power][troop] += count if count is not None else 1
+
+        return armies, unreadable
+
+    def battle_armies(self, battle, armies=None):
+        power, attack_territories, defense_territory = battle
+        armies = self.armies if armies is None else armies
+        attack = Army(power)
+        for name in attack_territories:
+            if power in armies[name]:
+                attack = attack + armies[name][power]
+        defense = Army(None)
+        for owner, army in armies[defense_territory].items():
+            if owner != power:
+                defense = defense + army
+        return attack, defense
+
+    def battle_odds(self, attack, defense):
+        # land_battle without the timer on calculate_full_battle printing every frame
+        attack_ball = CasualtyBall(attack, attacker=True, loss_order="IATFB", need_conquer=self.need_conquer)
+        defense_ball = CasualtyBall(defense, attacker=False, loss_order="GIABTF", need_conquer=False)
+        states = calculator.calculate_full_battle.__wrapped__(attack, attack_ball, defense, defense_ball) # untimed
+        return battle_summary(states, attack_ball, defense_ball)
+
+    def process(self, img):
+        """
+            Runs one screenshot through the pipeline.
+
+        Returns:
+            FrameResult with the updated armies and battle odds, and the latency of every stage in seconds
+        """
+        result = FrameResult()
+        start = perf_counter()
+
+        grey = cv.cvtColor(img, cv.COLOR_BGR2GRAY)
+        result.changed_territories = self.changed_regions(grey)
+        self.prev_grey = grey
+        t = perf_counter()
+        result.timings["diff"] = t - start
+
+        parsed = {name : self.parse_region(img, name) for name in result.changed_territories}
+        t2 = perf_counter()
+        result.timings["match"] = t2 - t
+
+        for name, (armies, unreadable) in parsed.items():
+            def keys(by_power):
+                return {power : army_key(army) for power, army in by_power.items()}
+            if keys(self.armies[name]) == keys(armies) and keys(self.unreadable[name]) == keys(unreadable):
+                continue
+            self.armies[name] = armies
+            self.unreadable[name] = unreadable
+            result.updated_armies[name] = armies
+            if unreadable:
+                result.unreadable[name] = unreadable
+            if self.territory_map is not None:
+                self.territory_map.territory_map[name].armies = list(armies.values())
+        t3 = perf_counter()
+        result.timings["armies"] = t3 - t2
+
+        for idx, battle in enumerate(self.battles):
+            territories = set(battle[1]) | {battle[2]}
+            if idx in self.results and not territories & set(result.updated_armies):
+                continue
+            attack, defense = self.battle_armies(battle)
+            unknown_attack, unknown_defense = self.battle_armies(battle, self.unreadable)
+            uncertain = any(army_key(unknown_attack)) or any(army_key(unknown_defense))
+            keys = (army_key(attack), army_key(defense), uncertain)
+            if self.battle_keys.get(idx) == keys:
+                continue
+            self.battle_keys[idx] = keys
+            if attack.value() == 0 or sum(keys[1]) == 0: # nothing to fight
+                self.results[idx] = None
+            else:
+                self.results[idx] = self.battle_odds(attack, defense)
+            if uncertain:
+                self.uncertain.add(idx)
+                result.uncertain_battles.append(idx)
+            else:
+                self.uncertain.discard(idx)
+            result.updated_battles[idx] = self.results[idx]
+        t4 = perf_counter()
+        result.timings["battles"] = t4 - t3
+        result.timings["total"] = t4 - start
+
+        if result.updated_armies:
+            for callback in self.listeners:
+                callback(result)
+
+        return result
+
+    def stream(self, frames):
+        """
+            Generator over FrameResults for an iterable of screenshots.
+        """
+        for img in frames:
+            yield self.process(img)
+
+def main():
+    img = cv.imread("full.png")
+    regions = { # rough boxes for a few territories of full.png
+        "Germany" : (1080, 600, 110, 130),
+        "Karelia" : (1180, 160, 150, 200),
+    }
+    pipeline = BoardPipeline(regions, battles=[])
+    for frame in [img, img.copy()]:
+        result = pipeline.process(frame)
+        print(result.changed_territories, {name : list(armies) for name, armies in result.updated_armies.items()})
+        print({stage : f"{t * 1000:.1f}ms" for stage, t in result.timings.items()})
+
+if __name__ == '__main__':
+    main()
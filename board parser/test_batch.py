@@ -0,0 +1,111 @@
+"""
+    A file for testing the functionality of batch.py
+"""
+import json
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import cv2 as cv
+
+import batch
+from batch import load_done, find_screenshots, process_directory, parse_screenshot
+
+class LoadDone(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.out = os.path.join(self.tmp.name, "units.jsonl")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, data):
+        with open(self.out, "wb") as f:
+            f.write(data)
+
+    def read(self):
+        with open(self.out, "rb") as f:
+            return f.read()
+
+    def test_missing_file(self):
+        self.assertEqual(load_done(self.out), set())
+        self.assertFalse(os.path.exists(self.out))
+
+    def test_complete_file(self):
+        data = b'{"path": "a.png", "units": {}}\n{"path": "b.png", "error": "could not decode image"}\n'
+        self.write(data)
+        self.assertEqual(load_done(self.out), {"a.png", "b.png"})
+        self.assertEqual(self.read(), data)
+
+    def test_truncates_partial_line(self):
+        self.write(b'{"path": "a.png", "units": {}}\n{"path": "b.p')
+        self.assertEqual(load_done(self.out), {"a.png"})
+        self.assertEqual(self.read(), b'{"path": "a.png", "units": {}}\n')
+
+        self.write(b'{"path": "a.p')
+        self.assertEqual(load_done(self.out), set())
+        self.assertEqual(self.read(), b"")
+
+    def test_skips_bad_lines(self):
+        self.write(b'{"path": "a.png"}\nnot json\n{"units": {}}\n\n{"path": "b.png"}\n')
+        self.assertEqual(load_done(self.out), {"a.png", "b.png"})
+
+class Resume(unittest.TestCase):
+
+    def test_resume(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            root = os.path.join(tmp, "screenshots")
+            os.makedirs(os.path.join(root, "b"))
+            blank = np.zeros((40, 40, 3), dtype=np.uint8)
+            for path in ("1.png", os.path.join("b", "2.png"), os.path.join("b", "3.jpg")):
+                cv.imwrite(os.path.join(root, path), blank)
+            with open(os.path.join(root, "broken.png"), "wb") as f:
+                f.write(b"not an image")
+            with open(os.path.join(root, "notes.txt"), "w") as f:
+                f.write("not a screenshot")
+
+            paths = list(find_screenshots(root))
+            self.assertEqual(paths, ["1.png", "broken.png", os.path.join("b", "2.png"), os.path.join("b", "3.jpg")])
+
+            # an earlier run finished 1.png and was interrupted while writing the next line
+            out = os.path.join(tmp, "units.jsonl")
+            with open(out, "w") as f:
+                f.write(json.dumps({"path" : "1.png", "units" : {}}) + "\n" + '{"path": "b/2')
+
+            self.assertEqual(process_directory(root, out, workers=1), 3)
+            with open(out) as f:
+                records = [json.loads(line) for line in f]
+            self.assertEqual(sorted(record["path"] for record in records), sorted(paths))
+            self.assertEqual([record for record in records if "error" in record], [{"path" : "broken.png", "error" : "could not decode image"}])
+
+            # everything is done, so running again parses nothing
+            self.assertEqual(process_directory(root, out, workers=1), 0)
+
+class ParseErrors(unittest.TestCase):
+
+    def setUp(self):
+        self.worker = batch._bank, batch._recognizer
+        batch.init_worker(batch.PARSER_DIR, os.path.join(batch.PARSER_DIR, "digits.npz"))
+
+    def tearDown(self):
+        batch._bank, batch._recognizer = self.worker
+
+    def test_tiny_image(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cv.imwrite(os.path.join(tmp, "tiny.png"), np.zeros((8, 8, 3), dtype=np.uint8))
+            self.assertEqual(parse_screenshot((tmp, "tiny.png")), {"path" : "tiny.png", "units" : {}})
+
+    def test_error_record(self):
+        class BrokenBank:
+            def match(self, img):
+                raise ValueError("no templates")
+
+        batch._bank = BrokenBank()
+        with tempfile.TemporaryDirectory() as tmp:
+            cv.imwrite(os.path.join(tmp, "1.png"), np.zeros((40, 40, 3), dtype=np.uint8))
+            self.assertEqual(parse_screenshot((tmp, "1.png")), {"path" : "1.png", "error" : "ValueError: no templates"})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+"""
+    A file for testing the functionality of cv.py
+"""
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import cv2 as cv
+
+from cv import TEMPLATE_NAMES, TemplateBank, match_distinct, suppress_matches, split_glyphs, DigitRecognizer, match_counts, number_box, NUMBER_SIZE
+
+PARSER_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def badge(text, dark=True):
+    """
+        Draws a count badge like the game's: a coloured ring around a black fill with a white digit,
+        or a yellow fill with a black digit.
+    """
+    img = np.zeros((NUMBER_SIZE, NUMBER_SIZE, 3), dtype=np.uint8)
+    centre = NUMBER_SIZE // 2
+    cv.circle(img, (centre, centre), centre, (0, 0, 255), -1)
+    cv.circle(img, (centre, centre), centre - 2, (0, 0, 0) if dark else (0, 220, 255), -1)
+    (w, h), _ = cv.getTextSize(text, cv.FONT_HERSHEY_PLAIN, 0.7, 1)
+    cv.putText(img, text, (centre - w // 2, centre + h // 2), cv.FONT_HERSHEY_PLAIN, 0.7, (255, 255, 255) if dark else (0, 0, 0), 1)
+    return img
+
+class Suppression(unittest.TestCase):
+
+    def test_threshold(self):
+        scores = np.zeros((10, 10))
+        scores[2, 3] = 0.9
+        scores[7, 8] = 0.79
+        labels = np.full((10, 10), 4)
+        self.assertEqual(suppress_matches(scores, labels, 0.8, 3), [(3, 2, 4)])
+        self.assertEqual(suppress_matches(scores, labels, 0.5, 3), [(3, 2, 4), (8, 7, 4)])
+        self.assertEqual(suppress_matches(np.zeros((10, 10)), labels, 0.8, 3), [])
+
+    def test_spacing(self):
+        scores = np.zeros((20, 20))
+        labels = np.zeros((20, 20), dtype=np.int64)
+        scores[5, 5], labels[5, 5] = 0.9, 1
+        scores[5, 7], labels[5, 7] = 0.95, 2 # too close, the earlier match in reading order wins
+        scores[8, 3], labels[8, 3] = 0.9, 3 # within spacing of (5, 5) on both axes
+        scores[9, 5], labels[9, 5] = 0.9, 4 # one row too far down
+        scores[5, 9], labels[5, 9] = 0.9, 5 # one column too far right
+        self.assertEqual(suppress_matches(scores, labels, 0.8, 3), [(5, 5, 1), (9, 5, 5), (5, 9, 4)])
+        self.assertEqual(suppress_matches(scores, labels, 0.8, 0), [(5, 5, 1), (7, 5, 2), (9, 5, 5), (3, 8, 3), (5, 9, 4)])
+
+class Bank(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        os.chdir(PARSER_DIR) # match_distinct reads the templates and screenshot from the working directory
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+
+    def test_match_full_screenshot(self):
+        # the batched bank finds the same units as matching every template on its own
+        bank = TemplateBank(PARSER_DIR)
+        names = list(bank.templates)
+        expected = match_distinct("full.png", names, do_rgb=False)
+        found = bank.match(cv.imread("full.png"))
+
+        def troops(locs):
+            return {point : TEMPLATE_NAMES[name][1] for name, points in locs.items() for point in points}
+        # only the troop has to agree, grey matching alone takes some American units for German ones
+        self.assertEqual(troops(found), troops(expected))
+        self.assertEqual(found["american_art"], [(394, 622)])
+        self.assertEqual(expected["german_art"].count((394, 622)), 1)
+        self.assertGreater(len(found["german_inf"]), 0)
+        self.assertGreater(len(found["british_inf"]), 0)
+
+    def test_image_smaller_than_templates(self):
+        bank = TemplateBank(PARSER_DIR)
+        for shape in ((10, 10, 3), (10, 200, 3), (200, 22, 3)):
+            locs = bank.match(np.zeros(shape, dtype=np.uint8))
+            self.assertEqual(set(locs), set(bank.templates))
+            self.assertFalse(any(locs.values()))
+
+class Digits(unittest.TestCase):
+
+    def test_split_glyphs(self):
+        for dark in (True, False):
+            self.assertEqual(len(split_glyphs(badge("3", dark))), 1)
+            self.assertEqual(len(split_glyphs(badge("12", dark))), 2)
+            self.assertEqual(split_glyphs(badge("", dark)), [])
+
+        # the same digit is the same glyph on either badge
+        white, black = split_glyphs(badge("3", True))[0], split_glyphs(badge("3", False))[0]
+        self.assertLess(np.abs(white - black).sum(), 1)
+
+    def test_read(self):
+        recognizer = DigitRecognizer().fit([badge(str(d)) for d in range(1, 5)], range(1, 5))
+        self.assertEqual(len(recognizer.prototypes), 4)
+        self.assertEqual(recognizer.digits(), [1, 2, 3, 4])
+        self.assertEqual(recognizer.read([badge("2"), badge("4", dark=False), badge("12"), badge("")]), [2, 4, 12, None])
+
+    def test_read_rejects_unknown_digits(self):
+        recognizer = DigitRecognizer().fit([badge(str(d)) for d in range(1, 5)], range(1, 5))
+        recognizer.max_distance = 5.0
+        self.assertEqual(recognizer.read([badge("3"), badge("8"), badge("18")]), [3, None, None])
+
+        # without a threshold we fall back on how far apart prototypes of one digit are
+        recognizer = DigitRecognizer().fit([badge("1"), badge("1", dark=False), badge("2")], [1, 1, 2])
+        self.assertLess(recognizer.rejection_distance(), 1)
+        self.assertEqual(recognizer.read([badge("1"), badge("2"), badge("8")]), [1, 2, None])
+
+    def test_save_load(self):
+        recognizer = DigitRecognizer(max_distance=7.5).fit([badge("1"), badge("2")], [1, 2])
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "digits.npz")
+            recognizer.save(path)
+            loaded = DigitRecognizer.load(path)
+        self.assertEqual(loaded.max_distance, 7.5)
+        self.assertEqual(loaded.labels.tolist(), [1, 2])
+
+    def test_match_counts(self):
+        recognizer = DigitRecognizer().fit([badge(str(d)) for d in range(1, 5)], range(1, 5))
+        img = np.zeros((60, 60, 3), dtype=np.uint8)
+        x1, y1, x2, y2 = number_box((5, 5))
+        img[y1:y2, x1:x2] = badge("3")
+
+        counts = match_counts(img, {"inf" : [(5, 5), (50, 50)]}, recognizer)
+        self.assertEqual(counts["inf"], [(50, 50, None), (5, 5, 3)]) # the cut off badge still counts as a unit
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,183 @@
+"""
+    A file for testing the functionality of pipeline.py
+"""
+import io
+import unittest
+from contextlib import redirect_stdout
+
+import numpy as np
+
+from cv import template_name, number_box
+from troop import Troop, Power
+from pipeline import BoardPipeline
+
+RED_INF = template_name(Power.R, Troop.inf)
+GERMAN_INF = template_name(Power.G, Troop.inf)
+MARKERS = {RED_INF : (0, 0, 255), GERMAN_INF : (255, 0, 0)} # colour of the pixel standing in for each icon
+COUNT_LEVEL = 40 # green level per unit on a badge, large enough for the frame diff to notice
+
+class MarkerBank:
+    """
+        Stands in for TemplateBank, a unit is a single pixel of its template's marker colour.
+    """
+    def match(self, img):
+        locs = {}
+        for name, color in MARKERS.items():
+            ys, xs = np.nonzero((img == color).all(axis=2))
+            locs[name] = list(zip(xs.tolist(), ys.tolist()))
+        return locs
+
+class PixelRecognizer:
+    """
+        Stands in for DigitRecognizer, the count is read off the green level of the badge's top left pixel.
+    """
+    def read(self, crops):
+        return [int(crop[0, 0, 1]) // COUNT_LEVEL or None for crop in crops]
+
+def draw_unit(img, name, loc, count):
+    x, y = loc
+    img[y, x] = MARKERS[name]
+    x1, y1, _, _ = number_box(loc)
+    img[y1, x1] = (0, count * COUNT_LEVEL, 0)
+
+def board(units):
+    img = np.zeros((120, 520, 3), dtype=np.uint8)
+    for name, loc, count in units:
+        draw_unit(img, name, loc, count)
+    return img
+
+REGIONS = {
+    "Karelia" : (0, 0, 100, 80),
+    "Germany" : (200, 0, 100, 80),
+    "Ukraine" : (400, 0, 100, 80),
+}
+KARELIA = [(RED_INF, (10, 10), 3)]
+GERMANY = [(GERMAN_INF, (210, 10), 2)]
+UKRAINE = [(GERMAN_INF, (410, 10), 1)]
+
+def pipeline(battles=((Power.R, ["Karelia"], "Germany"),)):
+    return BoardPipeline(REGIONS, battles, bank=MarkerBank(), recognizer=PixelRecognizer())
+
+class ChangedRegions(unittest.TestCase):
+
+    def test_first_frame(self):
+        p = pipeline()
+        grey = np.zeros((120, 520), dtype=np.uint8)
+        self.assertEqual(p.changed_regions(grey), list(REGIONS))
+
+        p.prev_grey = grey
+        self.assertEqual(p.changed_regions(grey.copy()), [])
+        self.assertEqual(p.changed_regions(np.zeros((100, 520), dtype=np.uint8)), list(REGIONS)) # resized screen
+
+    def test_changes(self):
+        p = pipeline()
+        p.prev_grey = np.zeros((120, 520), dtype=np.uint8)
+
+        grey = p.prev_grey.copy()
+        grey[50, 250] = p.diff_threshold # not enough of a change
+        self.assertEqual(p.changed_regions(grey), [])
+        grey[50, 250] = 255
+        self.assertEqual(p.changed_regions(grey), ["Germany"])
+
+        # a badge hanging over the border of a territory still counts for it
+        grey = p.prev_grey.copy()
+        grey[90, 330] = 255
+        self.assertEqual(p.changed_regions(grey), ["Germany"])
+
+class Process(unittest.TestCase):
+
+    def test_armies(self):
+        p = pipeline()
+        result = p.process(board(KARELIA + GERMANY + UKRAINE))
+        self.assertEqual(result.changed_territories, list(REGIONS))
+        self.assertEqual(p.armies["Karelia"][Power.R][Troop.inf], 3)
+        self.assertEqual(p.armies["Germany"][Power.G][Troop.inf], 2)
+        self.assertEqual(set(result.updated_armies), set(REGIONS))
+        self.assertEqual(list(result.updated_battles), [0])
+        self.assertIsNotNone(p.results[0])
+
+    def test_unchanged_frame(self):
+        p = pipeline()
+        p.process(board(KARELIA + GERMANY + UKRAINE))
+        result = p.process(board(KARELIA + GERMANY + UKRAINE))
+        self.assertEqual(result.changed_territories, [])
+        self.assertEqual(result.updated_battles, {})
+
+    def test_recompute_only_changed_battles(self):
+        p = pipeline(battles=[(Power.R, ["Karelia"], "Germany"), (Power.R, ["Karelia"], "Ukraine")])
+        p.process(board(KARELIA + GERMANY + UKRAINE))
+        first = dict(p.results)
+
+        result = p.process(board(KARELIA + [(GERMAN_INF, (210, 10), 4)] + UKRAINE))
+        self.assertEqual(result.changed_territories, ["Germany"])
+        self.assertEqual(list(result.updated_battles), [0])
+        self.assertEqual(p.results[1], first[1])
+        self.assertLess(p.results[0][0], first[0][0]) # more defenders, less chance to win
+
+        # both battles attack from Karelia
+        result = p.process(board([(RED_INF, (10, 10), 5), (GERMAN_INF, (210, 10), 4)] + UKRAINE))
+        self.assertEqual(sorted(result.updated_battles), [0, 1])
+
+    def test_same_armies_not_recomputed(self):
+        p = pipeline()
+        p.process(board(KARELIA + GERMANY))
+
+        # the pixels changed but the army didn't, so nothing is recomputed
+        result = p.process(board(KARELIA + [(GERMAN_INF, (220, 20), 2)]))
+        self.assertEqual(result.changed_territories, ["Germany"])
+        self.assertEqual(result.updated_armies, {})
+        self.assertEqual(result.updated_battles, {})
+
+        # the armies changed, but not the battle, since the attacker's own units in Germany don't defend it
+        result = p.process(board(KARELIA + [(GERMAN_INF, (220, 20), 2), (RED_INF, (250, 20), 1)]))
+        self.assertEqual(list(result.updated_armies), ["Germany"])
+        self.assertEqual(result.updated_battles, {})
+
+    def test_nothing_to_fight(self):
+        p = pipeline()
+        result = p.process(board(KARELIA))
+        self.assertIsNone(result.updated_battles[0])
+
+        result = p.process(board(KARELIA + GERMANY))
+        self.assertIsNotNone(result.updated_battles[0])
+
+    def test_unreadable_badge(self):
+        p = pipeline()
+        result = p.process(board([(RED_INF, (10, 10), 0)] + GERMANY))
+        self.assertEqual(p.armies["Karelia"][Power.R][Troop.inf], 1) # an unreadable badge is at least a single unit
+        self.assertEqual(p.unreadable["Karelia"][Power.R][Troop.inf], 1)
+        self.assertEqual(list(result.unreadable), ["Karelia"])
+        self.assertEqual(result.uncertain_battles, [0])
+        self.assertEqual(p.uncertain, {0})
+
+        # the same army with a readable badge is no longer uncertain
+        p.prev_grey = None # going from no count to 1 is too faint for the frame diff
+        result = p.process(board([(RED_INF, (10, 10), 1)] + GERMANY))
+        self.assertEqual(list(result.updated_armies), ["Karelia"])
+        self.assertEqual(p.unreadable["Karelia"], {})
+        self.assertEqual(list(result.updated_battles), [0])
+        self.assertEqual(result.uncertain_battles, [])
+        self.assertEqual(p.uncertain, set())
+
+        # unreadable units of the attacker elsewhere don't make the battle uncertain
+        result = p.process(board([(RED_INF, (10, 10), 1)] + GERMANY + [(RED_INF, (410, 10), 0)]))
+        self.assertEqual(list(result.unreadable), ["Ukraine"])
+        self.assertEqual(result.updated_battles, {})
+
+    def test_quiet(self):
+        # the timer on calculate_full_battle would print every frame
+        output = io.StringIO()
+        with redirect_stdout(output):
+            pipeline().process(board(KARELIA + GERMANY))
+        self.assertEqual(output.getvalue(), "")
+
+    def test_listeners(self):
+        p = pipeline()
+        seen = []
+        p.subscribe(seen.append)
+        p.process(board(KARELIA + GERMANY))
+        p.process(board(KARELIA + GERMANY))
+        self.assertEqual(len(seen), 1) # only frames that changed any armies
+
+if __name__ == '__main__':
+    unittest.main()
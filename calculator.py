@@ -5,7 +5,7 @@
 """
 from scipy.stats import binom, norm
 import itertools
-from functools import reduce, lru_cache
+from functools import reduce, lru_cache, wraps
 from time import time
 
 import numpy as np
@@ -13,7 +13,8 @@ from troop import Army, Troop, ATTACK_HIT_DIE, DEFENSE_HIT_DIE
 
 def timer(func):
     # This function shows the execution time of
-    # the function object passed
+    # the function object passed. The untimed function stays reachable as .__wrapped__
+    @wraps(func)
     def wrap_func(*args, **kwargs):
         t1 = time()
         result = func(*args, **kwargs)
@@ -81,28 +82,19 @@ def pure_hits(hit_counts):
     return tuple(total_dist)
 
 
-@timer
-def calculate_full_battle(attacking_army, attack_casualty_ball, defending_army, defense_casualty_ball):
-    """
-        Calculates possible results of a given battle
-        and then returns a tuple (win_chance, tie_chance, loss_chance, avg_attack_loss, avg_defense_loss)
+def stalemate(attack_casualty_ball, defense_casualty_ball, i, j, k=0):
+    # neither side has any hit dice left in state (i, j, k), like transports against transports
+    return sum(attack_casualty_ball.remaining_hits(i, k)[-4:]) == 0 and sum(defense_casualty_ball.remaining_hits(j)[-4:]) == 0
 
-        We simulate the battle using markov chains with a state being (h1, h2, a), the number of offense hits,
-        defense hits, and aa gun hits
-    Args:
-        attacking_army (troop.Army):
-        defending_army (troop.Army):
+def aa_shots(attacking_army, defending_army):
+    # each AA gun fires up to 3 shots, one per attacking air unit
+    return min(defending_army[Troop.aa] * 3, attacking_army[Troop.fighter] + attacking_army[Troop.bomber])
 
-    Returns:
-        a dictionary of states
+def bombard_dice(attacking_army):
+    """
+        Computes how many cruisers and battleships get to bombard, as (cruisers, battleships).
+        Each land unit can be supported by at most one bombarding ship, battleships first.
     """
-    n, m = attack_casualty_ball.combatants, defense_casualty_ball.combatants
-
-    # first, compute AA gun hits. Sadly, this can't be part of our markov chain because the hits are out of order.
-    aa_dice = min(defending_army[Troop.aa] * 3, attacking_army[Troop.fighter] + attacking_army[Troop.bomber])
-    aa = hit_dist(aa_dice, 1) # AA hit on a 1 only during AA step
-
-    # next, compute the shore bombardment for the attacker.
     land_units = attacking_army[Troop.inf] + attacking_army[Troop.art] + attacking_army[Troop.tank]
     num_bombard = min(attacking_army[Troop.cruiser] + attacking_army[Troop.battleship], land_units)
 
@@ -115,22 +107,76 @@ def calculate_full_battle(attacking_army, attack_casualty_ball, defending_army,
     else:
         battleship_bombard = min(attacking_army[Troop.battleship], num_bombard)
 
-    bombard = combine_dist(hit_dist(cruiser_bombard, ATTACK_HIT_DIE[Troop.cruiser]), hit_dist(battleship_bombard, ATTACK_HIT_DIE[Troop.battleship]))
+    return cruiser_bombard, battleship_bombard
 
-    states = {(i, j, k) : 0.0 for i in range(n + 1) for j in range(m + 1) for k in range(aa_dice + 1)}
+def bombard_dist(attacking_army):
+    # hit distribution of shore bombardment by cruisers and battleships
+    cruiser_bombard, battleship_bombard = bombard_dice(attacking_army)
+    return combine_dist(hit_dist(cruiser_bombard, ATTACK_HIT_DIE[Troop.cruiser]), hit_dist(battleship_bombard, ATTACK_HIT_DIE[Troop.battleship]))
 
-    # initial states are based on aa hits
+def opening_round(attacking_army, attack_casualty_ball, defending_army, defense_casualty_ball):
+    """
+        Computes the hit distributions of the first round of combat, which is special
+        because AA guns fire before it and shore bombardment joins it.
+
+    Returns:
+        list of (aa_hits, prob, hits_by_1, hits_by_2) tuples, one per number of AA hits
+    """
+    aa = hit_dist(aa_shots(attacking_army, defending_army), 1) # AA hit on a 1 only during AA step
+    bombard = bombard_dist(attacking_army)
+
+    rounds = []
     for (aa_hit, state_prob) in enumerate(aa):
         hits_by_1 = pure_hits(attack_casualty_ball.remaining_hits(0, aa_hit))
         hits_by_1 = combine_dist(hits_by_1, bombard) # add bombard damage to initial damage by attackers.
         hits_by_2 = pure_hits(defense_casualty_ball.remaining_hits(0))
+        rounds.append((aa_hit, state_prob, hits_by_1, hits_by_2))
+
+    return rounds
+
+def initial_states(attacking_army, attack_casualty_ball, defending_army, defense_casualty_ball):
+    """
+        Computes the distribution of states (h1, h2, a) after the opening round.
+
+    Returns:
+        (dictionary of reachable states -> probability, number of AA shots)
+    """
+    n, m = attack_casualty_ball.combatants, defense_casualty_ball.combatants
+    states = {}
 
+    for aa_hit, state_prob, hits_by_1, hits_by_2 in opening_round(attacking_army, attack_casualty_ball, defending_army, defense_casualty_ball):
         # basically the same as regular transition, except we don't normalize out the self-transition
         # because we are applying bombard here. Self-transition is the probability of no bombard hits.
         for (hit_by_1, prob1), (hit_by_2, prob2) in itertools.product(enumerate(hits_by_1), enumerate(hits_by_2)):
             hit_on_2 = min(m, hit_by_1) # can't be hit more times than you have units
             hit_on_1 = min(n - aa_hit, hit_by_2)
-            states[(hit_on_1, hit_on_2, aa_hit)] += state_prob * prob1 * prob2
+            state = (hit_on_1, hit_on_2, aa_hit)
+            states[state] = states.get(state, 0.0) + state_prob * prob1 * prob2
+
+    return states, aa_shots(attacking_army, defending_army)
+
+@timer
+def calculate_full_battle(attacking_army, attack_casualty_ball, defending_army, defense_casualty_ball):
+    """
+        Calculates possible results of a given battle
+        and then returns a tuple (win_chance, tie_chance, loss_chance, avg_attack_loss, avg_defense_loss)
+
+        We simulate the battle using markov chains with a state being (h1, h2, a), the number of offense hits,
+        defense hits, and aa gun hits
+    Args:
+        attacking_army (troop.Army):
+        defending_army (troop.Army):
+
+    Returns:
+        a dictionary of states
+    """
+    n, m = attack_casualty_ball.combatants, defense_casualty_ball.combatants
+
+    # first, compute AA gun hits and the opening round. Sadly, AA can't be part of our markov chain because the hits are out of order.
+    initial, aa_dice = initial_states(attacking_army, attack_casualty_ball, defending_army, defense_casualty_ball)
+
+    states = {(i, j, k) : 0.0 for i in range(n + 1) for j in range(m + 1) for k in range(aa_dice + 1)}
+    states.update(initial)
 
     # we loop over "state classes" here, which is casualties.
     # 2 states with the same total can never transition to each other, so they are unconnected in our markov chain!
@@ -160,6 +206,8 @@ def calculate_full_battle(attacking_army, attack_casualty_ball, defending_army,
 
                 # normalize away the self-transition of no one hitting anything
                 p1, p2 = hits_by_1[0], hits_by_2[0]
+                if p1 * p2 >= 1: # neither side can hit anything, the battle ends here as a stalemate
+                    continue
                 normalizer = (1 / (1 - p1 * p2))
 
                 # now, we add the corresponding transitions to other states
@@ -177,4 +225,249 @@ def calculate_full_battle(attacking_army, attack_casualty_ball, defending_army,
                 if abs(psum - 1) >= 1e-5:
                     print("ERROR: State probabilities don't add up.", psum, k, state_class, q, curr_state)
 
-    return states
\ No newline at end of file
+    return states
+
+def battle_rounds(attacking_army, attack_casualty_ball, defending_army, defense_casualty_ball, tolerance=1e-9, max_rounds=None):
+    """
+        Yields the distribution of states (h1, h2, a) after every round of combat, starting with the opening round.
+
+        Unlike calculate_full_battle, the self-transition of no one hitting anything is kept, so the
+        distribution after round r really is the battle after r rounds. Only the current and next round
+        are held in memory. Stops once less than tolerance probability is still fighting, or after max_rounds.
+    """
+    n, m = attack_casualty_ball.combatants, defense_casualty_ball.combatants
+    states, aa_dice = initial_states(attacking_army, attack_casualty_ball, defending_army, defense_casualty_ball)
+
+    rounds = 1
+    while True:
+        yield states
+
+        ongoing = sum(prob for (i, j, k), prob in states.items() if i + k < n and j < m
+                      and not stalemate(attack_casualty_ball, defense_casualty_ball, i, j, k))
+        if ongoing < tolerance or (max_rounds is not None and rounds >= max_rounds):
+            return
+
+        next_states = {}
+        for curr_state, state_prob in states.items():
+            i, j, k = curr_state
+            if i + k >= n or j >= m: # one side is dead, the state stays put
+                next_states[curr_state] = next_states.get(curr_state, 0.0) + state_prob
+                continue
+
+            hits_by_1 = pure_hits(attack_casualty_ball.remaining_hits(i, k))
+            hits_by_2 = pure_hits(defense_casualty_ball.remaining_hits(j))
+            for (hit_by_1, prob1), (hit_by_2, prob2) in itertools.product(enumerate(hits_by_1), enumerate(hits_by_2)):
+                hit_on_2 = min(m, hit_by_1 + j) # can't be hit more times than you have units
+                hit_on_1 = min(n - k, hit_by_2 + i)
+                state = (hit_on_1, hit_on_2, k)
+                next_states[state] = next_states.get(state, 0.0) + state_prob * prob1 * prob2
+
+        states = next_states
+        rounds += 1
+
+@lru_cache(maxsize=None)
+def hit_array(hit_counts):
+    # pure_hits as a numpy array, for the vectorized sweeps below
+    return np.array(pure_hits(hit_counts))
+
+def next_states(i, j, k, n, m, hits_by_1, hits_by_2):
+    """
+        Returns the index arrays (rows, cols) of the states reached from (i, j, k)
+        when the attacker scores cols - j hits and the defender scores rows - i hits.
+    """
+    rows = np.minimum(i + np.arange(len(hits_by_2)), n - k) # can't be hit more times than you have units
+    cols = np.minimum(j + np.arange(len(hits_by_1)), m)
+    return rows, cols
+
+def backward_values(attack_casualty_ball, defense_casualty_ball, aa_dice, terminal, decide=None, known=None):
+    """
+        Computes, for every state, the expected terminal value once the battle is fought out from that state.
+
+        This is the same markov chain as calculate_full_battle, but swept backwards over the state classes,
+        so one sweep answers the question for every starting state at once.
+
+    Args:
+        terminal (np.ndarray): (n + 1, m + 1, aa_dice + 1, F) values of the terminal states and of the stalemates
+            where neither side can hit anything, other entries are ignored
+        decide (function): optional decide(state, value) -> value, called on every non-terminal state.
+            Lets a caller pick between the value of fighting on and some alternative, like retreating.
+        known (np.ndarray): optional boolean (n + 1, m + 1, aa_dice + 1) array of states whose value in terminal
+            is already final, for example when it was reused from an earlier sweep.
+
+    Returns:
+        np.ndarray of the same shape as terminal
+    """
+    n, m = attack_casualty_ball.combatants, defense_casualty_ball.combatants
+    values = np.array(terminal, dtype=np.float64)
+
+    for state_class in range(n + m - 1, -1, -1):
+        for k in range(aa_dice + 1):
+            for q in range(max(0, state_class - n), min(state_class, m) + 1):
+                i, j = state_class - q, q
+                if i + k >= n or j >= m: # one side is dead, terminal value is given
+                    continue
+                if known is not None and known[i, j, k]:
+                    continue
+
+                hits_by_1 = hit_array(attack_casualty_ball.remaining_hits(i, k))
+                hits_by_2 = hit_array(defense_casualty_ball.remaining_hits(j))
+
+                transitions = np.outer(hits_by_2, hits_by_1) # [defense hits, attack hits]
+                stay = transitions[0, 0]
+                if stay >= 1: # no one can hit anything, the battle ends here and terminal holds its value
+                    continue
+                transitions[0, 0] = 0 # normalize away the self-transition of no one hitting anything
+
+                rows, cols = next_states(i, j, k, n, m, hits_by_1, hits_by_2)
+                value = np.tensordot(transitions, values[rows][:, cols, k], axes=2) / (1 - stay)
+                values[i, j, k] = decide((i, j, k), value) if decide else value
+
+    return values
+
+def opening_value(opening, values, n, m, offset=(0, 0)):
+    """
+        Expected value of a battle given its opening round (see opening_round) and the backward values of its states.
+        offset shifts the states into a larger battle's value table, see simulator.land_battle_grid.
+    """
+    total = 0
+    for aa_hit, state_prob, hits_by_1, hits_by_2 in opening:
+        rows, cols = next_states(offset[0], offset[1], aa_hit, offset[0] + n, offset[1] + m, hits_by_1, hits_by_2)
+        transitions = np.outer(hits_by_2, hits_by_1)
+        total = total + state_prob * np.tensordot(transitions, values[rows][:, cols, aa_hit], axes=2)
+
+    return total
+
+def log_convolve(log_dist1, log_dist2):
+    # combine_dist for distributions given as natural logs, so tiny probabilities don't underflow
+    total = np.full(len(log_dist1) + len(log_dist2) - 1, -np.inf)
+    hits = np.add.outer(np.arange(len(log_dist1)), np.arange(len(log_dist2)))
+    np.logaddexp.at(total, hits.ravel(), np.add.outer(log_dist1, log_dist2).ravel())
+    return total
+
+def log_hit_dist(hitters, die):
+    # natural log of hit_dist
+    return binom.logpmf(np.arange(hitters + 1), hitters, die / 6)
+
+@lru_cache(maxsize=None)
+def log_hit_array(hit_counts):
+    # natural log of pure_hits, computed without ever leaving log space
+    if len(hit_counts) == 5:
+        hit_counts = hit_counts[1:] # remove AA guns (hit 0) from consideration
+
+    total_dist = np.zeros(1)
+    for die, hitters in enumerate(hit_counts, start=1):
+        if hitters > 0:
+            total_dist = log_convolve(total_dist, log_hit_dist(hitters, die))
+
+    return total_dist
+
+@lru_cache(maxsize=None)
+def hit_array32(hit_counts):
+    # pure_hits as a float32 array
+    return hit_array(hit_counts).astype(np.float32)
+
+PRECISIONS = ("float64", "float32", "log")
+
+# largest error each engine is allowed on any chance, or on an average IPC loss relative to the IPC value of that side,
+# checked by accuracy.py. float64 is the reference everything else is measured against
+TOLERANCES = {
+    "backward" : 1e-9,
+    "float32" : 1e-4,
+    "log" : 1e-9,
+    "grid" : 1e-9,
+    "incremental" : 1e-9,
+    "anytime" : 1e-9,
+    "sea_battle" : 1e-9,
+    "sea_backward" : 1e-9,
+}
+
+def forward_battle(attacking_army, attack_casualty_ball, defending_army, defense_casualty_ball, precision="float32", prune=0.0):
+    """
+        calculate_full_battle with every state class pushed forward in one batch of numpy operations.
+
+        precision "float32" stores and combines probabilities in single precision, which is faster
+        but only good to TOLERANCES["float32"], 1e-4 (see accuracy.py for the measured error).
+        precision "log" stores natural logs of the probabilities, so states of very large battles whose
+        probability is far below the smallest float64 are still tracked instead of flushing to zero.
+        precision "float64" is the same sweep in double precision.
+        States with less than prune probability are left where they are instead of being pushed forward.
+
+    Returns:
+        (n + 1, m + 1, aa_dice + 1) array of state probabilities, or their natural logs for precision "log"
+    """
+    for states in forward_classes(attacking_army, attack_casualty_ball, defending_army, defense_casualty_ball, precision, prune):
+        pass
+    return states
+
+def forward_classes(attacking_army, attack_casualty_ball, defending_army, defense_casualty_ball, precision="float32", prune=0.0):
+    """
+        Generator behind forward_battle, yields its state array after the opening round and after every state class.
+        The array is updated in place, so copy it to keep it.
+
+        Probability only ever moves from fighting states to higher state classes, so the probability of the
+        terminal states reached so far only grows, and whatever is missing is still fighting.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision {precision}, forward_battle supports {', '.join(PRECISIONS)}")
+    log = precision == "log"
+
+    n, m = attack_casualty_ball.combatants, defense_casualty_ball.combatants
+    aa_dice = aa_shots(attacking_army, defending_army)
+    hits = {"float64" : hit_array, "float32" : hit_array32, "log" : log_hit_array}[precision]
+    empty = -np.inf if log else 0.0
+    threshold = (np.log(prune) if prune > 0 else -np.inf) if log else prune
+    states = np.full((n + 1, m + 1, aa_dice + 1), empty, dtype=np.float32 if precision == "float32" else np.float64)
+
+    # opening round, same as initial_states
+    if log:
+        bombard = log_convolve(*(log_hit_dist(dice, ATTACK_HIT_DIE[troop]) for dice, troop in zip(bombard_dice(attacking_army), (Troop.cruiser, Troop.battleship))))
+        for aa_hit, state_prob in enumerate(log_hit_dist(aa_dice, 1)):
+            hits_by_1 = log_convolve(log_hit_array(attack_casualty_ball.remaining_hits(0, aa_hit)), bombard)
+            hits_by_2 = log_hit_array(defense_casualty_ball.remaining_hits(0))
+            rows, cols = next_states(0, 0, aa_hit, n, m, hits_by_1, hits_by_2)
+            np.logaddexp.at(states, (rows[:, None], cols[None, :], aa_hit), state_prob + np.add.outer(hits_by_2, hits_by_1))
+    else:
+        initial, _ = initial_states(attacking_army, attack_casualty_ball, defending_army, defense_casualty_ball)
+        for state, state_prob in initial.items():
+            states[state] += state_prob
+    yield states
+
+    for state_class in range(0, n + m):
+        batch = [(state_class - q, q, k) for k in range(aa_dice + 1) for q in range(max(0, state_class - n), min(state_class, m) + 1)]
+        batch = [(i, j, k) for i, j, k in batch if i + k < n and j < m and states[i, j, k] > max(threshold, empty)] # skip dead, unreachable and pruned states
+        if not batch:
+            continue
+        i, j, k = (np.array(axis) for axis in zip(*batch))
+
+        # pad every state's hit distributions to the same length, the padding has probability 0
+        dists_1 = [hits(attack_casualty_ball.remaining_hits(*state[::2])) for state in batch]
+        dists_2 = [hits(defense_casualty_ball.remaining_hits(state[1])) for state in batch]
+        hits_by_1 = np.full((len(batch), max(map(len, dists_1))), empty, dtype=states.dtype)
+        hits_by_2 = np.full((len(batch), max(map(len, dists_2))), empty, dtype=states.dtype)
+        for b, (dist_1, dist_2) in enumerate(zip(dists_1, dists_2)):
+            hits_by_1[b, :len(dist_1)] = dist_1
+            hits_by_2[b, :len(dist_2)] = dist_2
+
+        rows = np.minimum(i[:, None] + np.arange(hits_by_2.shape[1]), (n - k)[:, None]) # can't be hit more times than you have units
+        cols = np.minimum(j[:, None] + np.arange(hits_by_1.shape[1]), m)
+        state_probs = states[i, j, k]
+
+        # [state, defense hits, attack hits], normalizing away the self-transition of no one hitting anything
+        if log:
+            transitions = hits_by_2[:, :, None] + hits_by_1[:, None, :]
+            stay = transitions[:, 0, 0].copy()
+            transitions[:, 0, 0] = -np.inf
+            moving = stay < 0 # states where no one can hit anything never move
+            scale = np.full(len(batch), -np.inf)
+            scale[moving] = state_probs[moving] - np.log(-np.expm1(stay[moving]))
+            transitions += scale[:, None, None]
+            np.logaddexp.at(states, (rows[:, :, None], cols[:, None, :], k[:, None, None]), transitions)
+        else:
+            transitions = hits_by_2[:, :, None] * hits_by_1[:, None, :]
+            stay = transitions[:, 0, 0].copy()
+            transitions[:, 0, 0] = 0
+            scale = np.where(stay < 1, state_probs / np.maximum(1 - stay, np.finfo(states.dtype).tiny), 0).astype(states.dtype)
+            transitions *= scale[:, None, None]
+            np.add.at(states, (rows[:, :, None], cols[:, None, :], k[:, None, None]), transitions)
+
+        yield states
@@ -0,0 +1,376 @@
+"""
+    This file contains a fast rollout engine for whole turns of Axis and Allies, for AI self-play.
+
+    A turn is purchase, combat move, battles, non-combat move, placement and income. The game state is
+    a handful of numpy arrays, so snapshots for tree search are cheap: a snapshot shares the arrays with
+    its parent and copies one only when it is first written to. Battles are resolved by sampling from
+    outcome tables computed once per matchup by the exact calculator, not by calling it every time.
+
+    TODO:
+        Naval and air movement, every unit currently moves one land territory per phase
+        Split surviving defenders between allied powers instead of handing them all to the owner
+"""
+from functools import lru_cache
+
+import numpy as np
+
+from troop import Troop, Army, Power, TROOP_IPC_VALUE
+from simulator import CasualtyBall
+import calculator
+import map
+
+ROLLOUT_TROOPS = [Troop.inf, Troop.art, Troop.tank, Troop.aa] # troops tracked in the game state, in array order
+MOBILE = np.array([troop != Troop.aa for troop in ROLLOUT_TROOPS]) # AA guns don't attack
+LAND_UNIT = np.array([troop in (Troop.inf, Troop.art, Troop.tank) for troop in ROLLOUT_TROOPS])
+COST = np.array([TROOP_IPC_VALUE[troop] for troop in ROLLOUT_TROOPS])
+
+POWERS = list(Power)
+POWER_INDEX = {power : i for i, power in enumerate(POWERS)}
+TURN_ORDER = [Power.J, Power.R, Power.G, Power.UK, Power.US]
+AXIS = {Power.G, Power.J}
+NO_OWNER = -1 # sea zones
+
+def is_enemy(power, other):
+    return (power in AXIS) != (other in AXIS)
+
+class Board:
+    """
+        The static part of a game: territories of a map.Map flattened into arrays.
+    """
+    def __init__(self, game_map):
+        self.territories = list(game_map.territory_map.values())
+        self.index = {territory.name : i for i, territory in enumerate(self.territories)}
+        self.ipc_value = np.array([territory.ipc_value for territory in self.territories], dtype=np.int32)
+        self.is_land = np.array([territory.is_land for territory in self.territories])
+        self.has_ic = np.array([territory.has_ic for territory in self.territories])
+        self.is_capital = np.array([territory.is_capital for territory in self.territories])
+        self.land_neighbors = [
+            [self.index[other.name] for other in game_map.land.neighbors(territory)] if territory.is_land else []
+            for territory in self.territories
+        ]
+
+class GameState:
+    """
+        Array-backed game state with copy-on-write snapshots.
+
+        units[territory, power, troop] counts ROLLOUT_TROOPS, owner[territory] is an index into POWERS
+        (NO_OWNER for sea zones), ipcs[power] is every power's bank, and turn counts turns played.
+        home[territory] is the starting owner, it is never written so every snapshot shares it.
+    """
+    ARRAYS = ("units", "owner", "ipcs")
+
+    def __init__(self, board, units, owner, ipcs, turn=0, home=None):
+        self.board = board
+        self.units = units
+        self.owner = owner
+        self.ipcs = ipcs
+        self.turn = turn
+        self.home = owner.copy() if home is None else home
+        self._owned = set(self.ARRAYS) # arrays this state may write to without copying
+
+    @classmethod
+    def from_setup(cls, board, owners, armies, ipcs):
+        """
+        Args:
+            owners (dict): territory name -> Power
+            armies (dict): territory name -> list of troop.Army
+            ipcs (dict): Power -> starting IPCs
+        """
+        units = np.zeros((len(board.territories), len(POWERS), len(ROLLOUT_TROOPS)), dtype=np.int16)
+        owner = np.full(len(board.territories), NO_OWNER, dtype=np.int8)
+        for name, power in owners.items():
+            owner[board.index[name]] = POWER_INDEX[power]
+        for name, army_list in armies.items():
+            for army in army_list:
+                for u, troop in enumerate(ROLLOUT_TROOPS):
+                    units[board.index[name], POWER_INDEX[army.owner], u] += army[troop]
+        bank = np.array([ipcs.get(power, 0) for power in POWERS], dtype=np.int32)
+        return cls(board, units, owner, bank)
+
+    def snapshot(self):
+        # O(1): both states now share every array, whichever writes first makes its own copy
+        child = GameState(self.board, self.units, self.owner, self.ipcs, self.turn, self.home)
+        child._owned = set()
+        self._owned = set()
+        return child
+
+    def writable(self, name):
+        if name not in self._owned:
+            setattr(self, name, getattr(self, name).copy())
+            self._owned.add(name)
+        return getattr(self, name)
+
+    def current_power(self):
+        return TURN_ORDER[self.turn % len(TURN_ORDER)]
+
+    def holds_capital(self, p):
+        capitals = self.board.is_capital & (self.home == p)
+        return bool((self.owner[capitals] == p).all())
+
+    def income(self, power):
+        # no income while your capital is held by the enemy
+        p = POWER_INDEX[power]
+        if not self.holds_capital(p):
+            return 0
+        return int(self.board.ipc_value[self.owner == p].sum())
+
+def army_from_counts(counts, owner=None):
+    army = Army(owner)
+    for troop, cnt in zip(ROLLOUT_TROOPS, counts):
+        army[troop] = int(cnt)
+    return army
+
+def counts_from_army(army):
+    counts = [army[troop] for troop in ROLLOUT_TROOPS]
+    counts[ROLLOUT_TROOPS.index(Troop.inf)] += army[Troop.supported_inf] # supported infantry is still infantry
+    return np.array(counts, dtype=np.int16)
+
+@lru_cache(maxsize=100000)
+def outcome_table(attack, defense):
+    """
+        Precomputes the terminal outcomes of a land battle for sampling.
+
+    Args:
+        attack, defense (tuple): counts of ROLLOUT_TROOPS
+
+    Returns:
+        (cumulative probabilities, attacker survivors, defender survivors, attacker won) arrays, one entry per outcome
+    """
+    attacking_army, defending_army = army_from_counts(attack), army_from_counts(defense)
+    need_conquer = any(cnt for cnt, land in zip(attack, LAND_UNIT) if land)
+    attack_ball = CasualtyBall(attacking_army, attacker=True, loss_order="IATFB", need_conquer=need_conquer)
+    defense_ball = CasualtyBall(defending_army, attacker=False, loss_order="GIABTF", need_conquer=False)
+    states = calculator.calculate_full_battle.__wrapped__(attacking_army, attack_ball, defending_army, defense_ball) # untimed
+    n, m = attack_ball.combatants, defense_ball.combatants
+
+    probs, attack_left, defense_left, won = [], [], [], []
+    for (offense_casualties, defense_casualties, aa_hits), prob in states.items():
+        attacker_dead = offense_casualties + aa_hits >= n
+        if prob <= 0 or not (attacker_dead or defense_casualties >= m):
+            continue
+        a = Army(None) if attacker_dead else attack_ball.remaining_troops(offense_casualties, aa_hits)
+        d = Army(None) if defense_casualties >= m else defense_ball.remaining_troops(defense_casualties)
+        probs.append(prob)
+        attack_left.append(counts_from_army(a))
+        defense_left.append(counts_from_army(d))
+        won.append(not attacker_dead and defense_casualties >= m)
+
+    cumulative = np.cumsum(probs)
+    cumulative /= cumulative[-1] # guard against the tiny drift of the float sums
+    return cumulative, np.array(attack_left), np.array(defense_left), np.array(won)
+
+def table_key(counts):
+    return tuple(int(cnt) for cnt in counts)
+
+def win_chance(attack, defense):
+    cumulative, _, _, won = outcome_table(table_key(attack), table_key(defense))
+    probs = np.diff(cumulative, prepend=0)
+    return float(probs[won].sum())
+
+class GreedyPolicy:
+    """
+        A simple default policy: buy mostly infantry, attack the neighbour with the best odds
+        when they beat attack_threshold, and walk idle units toward the front.
+    """
+    def __init__(self, attack_threshold=0.6, tank_share=0.25):
+        self.attack_threshold = attack_threshold
+        self.tank_share = tank_share
+
+    def purchase(self, state, power, rng):
+        # returns counts of ROLLOUT_TROOPS to buy
+        bought = np.zeros(len(ROLLOUT_TROOPS), dtype=np.int16)
+        budget = int(state.ipcs[POWER_INDEX[power]])
+        inf, tank = ROLLOUT_TROOPS.index(Troop.inf), ROLLOUT_TROOPS.index(Troop.tank)
+        while budget >= COST[inf]:
+            u = tank if budget >= COST[tank] and rng.random() < self.tank_share else inf
+            bought[u] += 1
+            budget -= COST[u]
+        return bought
+
+    def combat_moves(self, state, power, rng):
+        # returns (from, to, counts) moves
+        p = POWER_INDEX[power]
+        moves = []
+        for t in np.nonzero(state.owner == p)[0]:
+            attackers = np.where(MOBILE, state.units[t, p], 0)
+            if not attackers.any():
+                continue
+            best, best_odds = None, self.attack_threshold
+            for target in state.board.land_neighbors[t]:
+                if state.owner[target] == NO_OWNER or not is_enemy(power, POWERS[state.owner[target]]):
+                    continue
+                defenders = enemy_units(state, target, power)
+                odds = win_chance(attackers, defenders) if defenders.any() else 1.0
+                if odds > best_odds:
+                    best, best_odds = target, odds
+            if best is not None:
+                moves.append((t, best, attackers))
+        return moves
+
+    def noncombat_moves(self, state, power, rng):
+        p = POWER_INDEX[power]
+        board = state.board
+        def at_front(t):
+            return any(state.owner[n] != NO_OWNER and is_enemy(power, POWERS[state.owner[n]]) for n in board.land_neighbors[t])
+
+        moves = []
+        for t in np.nonzero(state.owner == p)[0]:
+            movers = np.where(MOBILE, state.units[t, p], 0)
+            if not movers.any() or at_front(t):
+                continue
+            friendly = [n for n in board.land_neighbors[t] if state.owner[n] == p]
+            forward = [n for n in friendly if at_front(n)] or friendly
+            if forward:
+                moves.append((t, forward[rng.integers(len(forward))], movers))
+        return moves
+
+def enemy_units(state, territory, power):
+    enemies = [i for i, other in enumerate(POWERS) if is_enemy(power, other)]
+    return state.units[territory, enemies].sum(axis=0)
+
+class RolloutEngine:
+    """
+        Plays turns on a GameState in place. Snapshot first to keep the original for tree search.
+    """
+    def __init__(self, policies=None, seed=None):
+        self.policies = policies or {}
+        self.default_policy = GreedyPolicy()
+        self.rng = np.random.default_rng(seed)
+
+    def policy(self, power):
+        return self.policies.get(power, self.default_policy)
+
+    def move(self, state, moves, power):
+        units = state.writable("units")
+        p = POWER_INDEX[power]
+        for src, dst, counts in moves:
+            counts = np.minimum(counts, units[src, p]) # earlier moves may have taken some of them
+            units[src, p] -= counts
+            units[dst, p] += counts
+
+    def resolve_battle(self, state, territory, power):
+        """
+            Samples the outcome of a battle in territory, and hands it over if the attacker conquers it.
+        """
+        p = POWER_INDEX[power]
+        attack = state.units[territory, p].copy()
+        defense = enemy_units(state, territory, power)
+        defender = int(state.owner[territory])
+
+        units = state.writable("units")
+        enemies = [i for i, other in enumerate(POWERS) if is_enemy(power, other)]
+        if defense.any():
+            cumulative, attack_left, defense_left, won = outcome_table(table_key(attack), table_key(defense))
+            outcome = min(int(np.searchsorted(cumulative, self.rng.random(), side="right")), len(cumulative) - 1)
+            units[territory, enemies] = 0
+            units[territory, defender] = defense_left[outcome]
+            units[territory, p] = attack_left[outcome]
+            attack = attack_left[outcome]
+            if not won[outcome]:
+                return
+
+        if (attack * LAND_UNIT).any(): # conquered!
+            owner = state.writable("owner")
+            home = int(state.home[territory])
+            liberated = home not in (NO_OWNER, p) and not is_enemy(power, POWERS[home])
+            if liberated and (state.board.is_capital[territory] or state.holds_capital(home)):
+                owner[territory] = home # an ally's territory goes back to it, unless it has lost its capital
+            else:
+                owner[territory] = p
+            if state.board.is_capital[territory] and defender != NO_OWNER and home == defender: # take the capital's bank
+                ipcs = state.writable("ipcs")
+                ipcs[p] += ipcs[defender]
+                ipcs[defender] = 0
+
+    def play_turn(self, state):
+        power = state.current_power()
+        p = POWER_INDEX[power]
+        policy = self.policy(power)
+
+        bought = policy.purchase(state, power, self.rng)
+        ipcs = state.writable("ipcs")
+        ipcs[p] -= int(bought @ COST)
+
+        combat = policy.combat_moves(state, power, self.rng)
+        self.move(state, combat, power)
+        for target in sorted({dst for _, dst, _ in combat}):
+            self.resolve_battle(state, target, power)
+
+        self.move(state, policy.noncombat_moves(state, power, self.rng), power)
+
+        factories = np.nonzero((state.owner == p) & state.board.has_ic)[0]
+        if len(factories): # new units appear at a random factory, otherwise the money is refunded
+            units = state.writable("units")
+            units[factories[self.rng.integers(len(factories))], p] += bought
+        else:
+            ipcs[p] += int(bought @ COST)
+
+        ipcs = state.writable("ipcs")
+        ipcs[p] += state.income(power)
+        state.turn += 1
+
+    def rollout(self, state, turns):
+        """
+            Plays turns from a snapshot of state, leaving state itself untouched.
+        """
+        state = state.snapshot()
+        for _ in range(turns):
+            self.play_turn(state)
+        return state
+
+SIMPLE_OWNERS = { # starting owners of the land territories of map.make_simple
+    "Eastern Canada" : Power.UK,
+    "Eastern United States" : Power.US,
+    "Greenland" : Power.US,
+    "Iceland" : Power.UK,
+    "Norway" : Power.G,
+    "Finland" : Power.G,
+    "Karelia" : Power.R,
+    "Baltic States" : Power.G,
+    "Germany" : Power.G,
+    "Northwestern Europe" : Power.G,
+    "France" : Power.G,
+    "United Kingdom" : Power.UK,
+}
+
+def simple_setup():
+    """
+        A starting position on map.make_simple, loosely following the 1942 setup.
+    """
+    board = Board(map.make_simple())
+    owners = SIMPLE_OWNERS
+
+    def army(power, inf=0, art=0, tank=0, aa=0):
+        r = Army(power)
+        r[Troop.inf], r[Troop.art], r[Troop.tank], r[Troop.aa] = inf, art, tank, aa
+        return [r]
+
+    armies = {
+        "Germany" : army(Power.G, inf=6, art=2, tank=3, aa=1),
+        "Northwestern Europe" : army(Power.G, inf=2, tank=1),
+        "France" : army(Power.G, inf=3, art=1),
+        "Norway" : army(Power.G, inf=2),
+        "Finland" : army(Power.G, inf=2),
+        "Baltic States" : army(Power.G, inf=2, art=1, tank=1),
+        "Karelia" : army(Power.R, inf=5, art=1, tank=1, aa=1),
+        "United Kingdom" : army(Power.UK, inf=3, art=1, aa=1),
+        "Eastern Canada" : army(Power.UK, inf=1),
+        "Eastern United States" : army(Power.US, inf=4, art=1, tank=1),
+    }
+    ipcs = {Power.R : 24, Power.G : 37, Power.UK : 31, Power.J : 30, Power.US : 42}
+    return GameState.from_setup(board, owners, armies, ipcs)
+
+def main():
+    from time import time
+    state = simple_setup()
+    engine = RolloutEngine(seed=0)
+    t1 = time()
+    for _ in range(100):
+        end = engine.rollout(state, turns=10)
+    t2 = time()
+    print(f"100 rollouts of 10 turns in {(t2-t1):.2f}s")
+    print({POWERS[p].name : int(end.ipcs[p]) for p in range(len(POWERS))})
+    print({t.name : POWERS[end.owner[i]].name for i, t in enumerate(end.board.territories) if end.owner[i] != NO_OWNER})
+
+if __name__ == '__main__':
+    main()
@@ -9,8 +9,10 @@
 """
 from ast import Raise
 from functools import lru_cache
+import numpy as np
+from scipy.signal import fftconvolve
 from troop import Troop, Army, Power
-from troop import ATTACK_HIT_DIE, DEFENSE_HIT_DIE, LOSS_ORDER_TROOP, AIR_UNITS, NAVAL_UNITS, TROOP_IPC_VALUE
+from troop import ATTACK_HIT_DIE, DEFENSE_HIT_DIE, LOSS_ORDER_TROOP, AIR_UNITS, NAVAL_UNITS, TROOP_IPC_VALUE, CARRIER_CAPACITY
 import calculator
 
 class CasualtyBall:
@@ -44,10 +46,8 @@ class CasualtyBall:
             self.need_conquer = need_conquer
         self.loss_order = loss_order
 
-        hits = [0] * 5
-        for troop, cnt in self.troops.items():
-            if troop not in NAVAL_UNITS and cnt > 0: # don't count naval units as casualties, or empty unit fields
-                hits[HIT_DIE[troop]] += cnt
+        self.attacker = attacker
+        self.hit_die = HIT_DIE
 
         if need_conquer:
             # save our most valuable land troop
@@ -63,23 +63,31 @@ class CasualtyBall:
             else:
                 raise ValueError("Tried to conquer without land units")
 
-        air_losses = [0] * 5
-        self.universal_hit_list = [tuple(hits)]
-        self.air_loss_list = [tuple(air_losses)]
-        for c in loss_order:
+    @lru_cache(maxsize=None)
+    def survivors(self, hits, aa_hits=0):
+        """
+            Returns the troops left alive after aa_hits air units were shot down and hits casualties were taken,
+            as a tuple of (troop, count) pairs. AA guns fire before combat, so they take the first air units
+            in the loss order. The other casualties follow the loss order over whatever is left, and our
+            last hero land unit (when need_conquer) goes last.
+        """
+        troops = dict(self.troops)
+        for c in self.loss_order:
             troop = LOSS_ORDER_TROOP[c]
-            for _ in range(self.troops[troop]): # for universal hits, we store the hits remaining after n casualties
-                hits[HIT_DIE[troop]] -= 1
-                self.universal_hit_list.append(tuple(hits))
-                if troop in AIR_UNITS: # for air losses, we store the losses taken (in dice #s) after n casualties
-                    air_losses[HIT_DIE[troop]] += 1
-                    self.air_loss_list.append(tuple(air_losses))
+            if troop in AIR_UNITS:
+                lost = min(troops[troop], aa_hits)
+                troops[troop] -= lost
+                aa_hits -= lost
 
-        # finally, our last hero land unit succumbs
-        if need_conquer:
-            hits[HIT_DIE[self.mvp]] -= 1
-            self.universal_hit_list.append(tuple(hits))
+        for c in self.loss_order:
+            troop = LOSS_ORDER_TROOP[c]
+            lost = min(troops[troop], hits)
+            troops[troop] -= lost
+            hits -= lost
 
+        if self.need_conquer and hits == 0:
+            troops[self.mvp] += 1
+        return tuple(troops.items())
 
     @lru_cache(maxsize=None)
     def remaining_hits(self, hits, aa_hits=0):
@@ -87,14 +95,16 @@ class CasualtyBall:
             this function returns the hit dice remaining after a certain number of hits
             can be called 10,000+ times, needs to be fast!!
         """
-        if hits >= self.land_units: # if all land units are hit, just add hits together!
-            total_hits = min(hits + aa_hits, self.combatants)
-            remaining = self.universal_hit_list[total_hits]
-        else: # otherwise,
-            remaining = self.universal_hit_list[hits] # what hit die do we have left from regular units?
-            aa_losses = self.air_loss_list[aa_hits]
-            remaining = [remaining[i] - aa_losses[i] for i in range(len(remaining))] # subtract out losses from AA
+        troops = dict(self.survivors(hits, aa_hits))
+        if self.attacker: # every artillery still standing supports an infantry, whichever of them died first
+            inf = troops[Troop.inf] + troops[Troop.supported_inf]
+            troops[Troop.supported_inf] = min(inf, troops[Troop.art])
+            troops[Troop.inf] = inf - troops[Troop.supported_inf]
 
+        remaining = [0] * 5
+        for troop, cnt in troops.items():
+            if cnt > 0: # don't count empty unit fields
+                remaining[self.hit_die[troop]] += cnt
         return tuple(remaining)
 
     def remaining_troops(self, hits, aa_hits=0):
@@ -108,23 +118,70 @@ class CasualtyBall:
         if hits + aa_hits >= self.combatants:
             return r
 
-        # assume everyone survived, and then kill them off
-        r.troops = self.troops.copy()
-
-        if hits < self.land_units and aa_hits > 0: # if hits is too small, we need AA seperate
-            for c in self.loss_order:
-                troop = LOSS_ORDER_TROOP[c]
-                if troop not in AIR_UNITS: # only AA hits here
-                    continue
-                if self.troops[troop] >= aa_hits:
-                    r.troops[troop] -= aa_hits
-                    break
-                else:
-                    aa_hits -= self.troops[troop]
-                    r.troops[troop] = 0
+        r.troops.update(self.survivors(hits, aa_hits))
+        return r
+
+class NavalCasualtyBall:
+    """
+        The sea battle version of CasualtyBall.
+
+        Battleships take two hits. Rather than adding a state dimension for damage, the first hit on every battleship
+        is a casualty of its own (loss order 'D') that removes no hit dice and no IPC, so a sea battle is the same markov
+        chain as a land battle with one extra casualty per battleship. Transports roll no dice and are zero-value
+        casualties. A defender's fighters are lost after combat if the surviving carriers can't hold them.
+    """
+    def __init__(self, army, attacker, loss_order):
+        if attacker:
+            HIT_DIE = ATTACK_HIT_DIE
         else:
-            hits += aa_hits # otherwise, just combine them!
+            HIT_DIE = DEFENSE_HIT_DIE
+
+        # only ships and planes fight at sea, land units on transports are cargo
+        self.troops = {troop : army.troops[troop] for troop in NAVAL_UNITS + AIR_UNITS}
+        self.troops[Troop.damaged_battleship] = self.troops[Troop.battleship]
+        self.attacker = attacker
+        self.loss_order = loss_order
+        self.land_units = 0
+        self.need_conquer = False
 
+        order_troops = [LOSS_ORDER_TROOP[c] for c in loss_order]
+        for troop, cnt in self.troops.items():
+            if cnt and troop not in order_troops:
+                raise ValueError(f"{troop.name} is missing from sea loss order {loss_order}")
+        if "W" in loss_order and "D" in loss_order and loss_order.index("W") < loss_order.index("D"):
+            raise ValueError(f"Sea loss order {loss_order} sinks battleships ('W') before damaging them ('D')")
+
+        self.combatants = sum(self.troops.values())
+        self.combatant_values = sum([cnt * TROOP_IPC_VALUE[troop] for troop, cnt in self.troops.items()])
+
+        hits = [0] * 5
+        for troop, cnt in self.troops.items():
+            if troop != Troop.damaged_battleship:
+                hits[HIT_DIE[troop]] += cnt
+
+        self.universal_hit_list = [tuple(hits)]
+        for c in loss_order:
+            troop = LOSS_ORDER_TROOP[c]
+            for _ in range(self.troops[troop]):
+                if troop != Troop.damaged_battleship: # a damaged battleship keeps firing
+                    hits[HIT_DIE[troop]] -= 1
+                self.universal_hit_list.append(tuple(hits))
+
+    @lru_cache(maxsize=None)
+    def remaining_hits(self, hits, aa_hits=0):
+        # there are no AA guns at sea, aa_hits is only here to match CasualtyBall
+        return self.universal_hit_list[min(hits + aa_hits, self.combatants)]
+
+    def remaining_troops(self, hits, aa_hits=0):
+        """
+            this function returns an Army with the troops left alive after the combat.
+        """
+        r = Army(None)
+        hits += aa_hits
+        if hits >= self.combatants:
+            return r
+
+        r.troops.update(self.troops)
         for c in self.loss_order:
             troop = LOSS_ORDER_TROOP[c]
             if self.troops[troop] >= hits:
@@ -134,18 +191,21 @@ class CasualtyBall:
                 hits -= self.troops[troop]
                 r.troops[troop] = 0
 
-        # if need_conquer, our MVP survived!!
-        if self.need_conquer:
-            r.troops[self.mvp] += 1
+        r.troops[Troop.damaged_battleship] = 0 # damage is repaired, the battleships are counted by themselves
+        if not self.attacker: # defending fighters need a carrier to land on
+            r.troops[Troop.fighter] = min(r.troops[Troop.fighter], CARRIER_CAPACITY * r.troops[Troop.carrier])
 
         return r
 
-def land_battle(attacking_army, defense, need_conquer=True, attack_loss_order="IATFB", defense_loss_order="GIABTF"):
+def land_battle(attacking_army, defense, need_conquer=True, attack_loss_order="IATFB", defense_loss_order="GIABTF", precision="float64"):
     """
         Given a land_battle between armies, this function forms a call to calculator.calculate_full_battle
         and then returns (win_chance, tie_chance, loss_chance, avg_attack_loss, avg_defense_loss)
         Defense can be either an army or a list of armies
 
+        precision picks the engine, "float64" is the exact calculator and "float32" / "log" the
+        vectorized calculator.forward_battle, see there for the trade offs.
+
     """
     if isinstance(defense, list):
        defending_army = sum(defense) # sum all defending armies
@@ -157,7 +217,20 @@ def land_battle(attacking_army, defense, need_conquer=True, attack_loss_order="I
     defense_ball = CasualtyBall(defending_army, attacker=False, loss_order=defense_loss_order, need_conquer=False)
 
     # actually calculate the land_battle
-    states = calculator.calculate_full_battle(attacking_army, attack_ball, defending_army, defense_ball)
+    if precision == "float64":
+        states = calculator.calculate_full_battle(attacking_army, attack_ball, defending_army, defense_ball)
+    else:
+        probs = calculator.forward_battle(attacking_army, attack_ball, defending_army, defense_ball, precision=precision)
+        if precision == "log":
+            probs = np.exp(probs)
+        states = {state : float(probs[state]) for state in zip(*np.nonzero(probs))}
+    return battle_summary(states, attack_ball, defense_ball)
+
+def battle_summary(states, attack_ball, defense_ball):
+    """
+        Sums the terminal states of calculator.calculate_full_battle into
+        (win_chance, tie_chance, loss_chance, avg_attack_loss, avg_defense_loss)
+    """
     n = attack_ball.combatants
     m = defense_ball.combatants
     orig_attack_val = attack_ball.combatant_values # only compute the IPC value of units in the fight
@@ -180,6 +253,11 @@ def land_battle(attacking_army, defense, need_conquer=True, attack_loss_order="I
             d = Army(None)
             win_chance += prob
             # print(f"{prob:.3f} Chance of attack winning with {state[0]} hits {state[2]} aa_hits and these units left ipc {a.value()}:\n{a}")
+        elif calculator.stalemate(attack_ball, defense_ball, offense_casualties, defense_casualties, aa_hits):
+            # neither side can hit anything, the attacker keeps its units but doesn't take the territory
+            a = attack_ball.remaining_troops(offense_casualties, aa_hits)
+            d = defense_ball.remaining_troops(defense_casualties)
+            loss_chance += prob
         else:
             continue # skip non-terminal states
 
@@ -188,6 +266,673 @@ def land_battle(attacking_army, defense, need_conquer=True, attack_loss_order="I
 
     return win_chance, tie_chance, loss_chance, avg_attack_loss, avg_defense_loss
 
+def fleet(army):
+    # the ships and planes of an army
+    r = Army(army.owner)
+    for troop in NAVAL_UNITS + AIR_UNITS:
+        r[troop] = army[troop]
+    return r
+
+def sea_battle(attacking_army, defense, attack_loss_order="DFCBKWN", defense_loss_order="DNCFKW"):
+    """
+        Given a sea battle between fleets, this function forms a call to calculator.calculate_full_battle
+        and then returns (win_chance, tie_chance, loss_chance, avg_attack_loss, avg_defense_loss)
+        Defense can be either an army or a list of armies.
+
+        Loss orders use 'D' for the first hit on a battleship, 'N' transport, 'C' cruiser, 'K' carrier,
+        'W' battleship, 'F' fighter and 'B' bomber. The attacker keeps its transports for last by default,
+        they carry the landing.
+    """
+    if isinstance(defense, list):
+       defending_army = sum(defense) # sum all defending armies
+    else:
+        defending_army = defense
+
+    # only ships and planes fight, which also keeps cargo from triggering shore bombardment
+    attacking_army, defending_army = fleet(attacking_army), fleet(defending_army)
+    attack_ball = NavalCasualtyBall(attacking_army, attacker=True, loss_order=attack_loss_order)
+    defense_ball = NavalCasualtyBall(defending_army, attacker=False, loss_order=defense_loss_order)
+
+    # no AA guns or shore bombardment at sea, so this is the plain markov chain over both fleets
+    states = calculator.calculate_full_battle(attacking_army, attack_ball, defending_army, defense_ball)
+    return battle_summary(states, attack_ball, defense_ball)
+
+def terminal_values(attack_ball, defense_ball, aa_dice):
+    """
+        Builds the terminal value table for calculator.backward_values.
+
+        Every state gets (win, tie, loss, attack IPC left, defense IPC left),
+        with all zeros for the states that are still fighting.
+        A stalemate where neither side can hit anything is a loss where both sides keep their units.
+    """
+    n, m = attack_ball.combatants, defense_ball.combatants
+    values = np.zeros((n + 1, m + 1, aa_dice + 1, 5))
+    defense_left = [defense_ball.remaining_troops(j).value() for j in range(m)]
+    for i in range(n + 1):
+        for k in range(aa_dice + 1):
+            if i + k >= n:
+                values[i, m, k, 1] = 1 # tie
+                for j in range(m):
+                    values[i, j, k, 2] = 1 # loss
+                    values[i, j, k, 4] = defense_left[j]
+            else:
+                values[i, m, k, 0] = 1 # win
+                values[i, m, k, 3] = attack_ball.remaining_troops(i, k).value()
+                for j in range(m):
+                    if calculator.stalemate(attack_ball, defense_ball, i, j, k):
+                        values[i, j, k, 2] = 1
+                        values[i, j, k, 3] = values[i, m, k, 3]
+                        values[i, j, k, 4] = defense_left[j]
+
+    return values
+
+def battle_result(value, attack_ball, defense_ball):
+    # turns expected terminal values into (win_chance, tie_chance, loss_chance, avg_attack_loss, avg_defense_loss)
+    win_chance, tie_chance, loss_chance, attack_left, defense_left = value
+    return win_chance, tie_chance, loss_chance, attack_ball.combatant_values - attack_left, defense_ball.combatant_values - defense_left
+
+def solve_battle(attacking_army, attack_ball, defending_army, defense_ball):
+    """
+        Same result as calculator.calculate_full_battle summed up by land_battle,
+        but computed with a single backward sweep over the battle's states.
+    """
+    aa_dice = calculator.aa_shots(attacking_army, defending_army)
+    values = calculator.backward_values(attack_ball, defense_ball, aa_dice, terminal_values(attack_ball, defense_ball, aa_dice))
+    opening = calculator.opening_round(attacking_army, attack_ball, defending_army, defense_ball)
+    value = calculator.opening_value(opening, values, attack_ball.combatants, defense_ball.combatants)
+    return battle_result(value, attack_ball, defense_ball)
+
+def attack_rows(ball, aa_dice):
+    # what the markov chain sees of an attacking army after i casualties: hitters and IPC left for every AA hit count
+    return [
+        tuple((ball.remaining_hits(i, k), ball.remaining_troops(i, k).value()) for k in range(aa_dice + 1))
+        for i in range(ball.combatants + 1)
+    ]
+
+def defense_rows(ball):
+    return [(ball.remaining_hits(j), ball.remaining_troops(j).value()) for j in range(ball.combatants + 1)]
+
+def share_chains(balls, rows):
+    """
+        Groups armies whose markov chains are tails of a larger army's chain.
+
+        If the troop being varied is lost first, the army with x more units looks exactly like the smaller army
+        once it has taken x casualties, so the smaller battle's states are a corner of the larger battle's states.
+
+    Returns:
+        dictionary from index to (index of the largest army in its group, casualty offset into it)
+    """
+    groups = {}
+    bigs = []
+    for idx in sorted(balls, key=lambda idx: -balls[idx].combatants):
+        for big in bigs:
+            offset = balls[big].combatants - balls[idx].combatants
+            if rows(big)[offset:] == rows(idx):
+                groups[idx] = (big, offset)
+                break
+        else:
+            bigs.append(idx)
+            groups[idx] = (idx, 0)
+
+    return groups
+
+def land_battle_grid(attacking_army, defending_army, attack_troop=None, attack_counts=(None,), defense_troop=None, defense_counts=(None,),
+                     need_conquer=True, attack_loss_order="IATFB", defense_loss_order="GIABTF"):
+    """
+        Computes land_battle for every combination of counts of one attacking and/or one defending troop,
+        everything else fixed. For example, attack_troop=Troop.inf, attack_counts=range(1, 41) with
+        defense_troop=Troop.inf, defense_counts=range(1, 41) gives a 40x40 heatmap.
+
+        Battles whose chains are corners of a bigger battle's chain share one backward sweep (see share_chains),
+        so the grid only needs a sweep per distinct chain plus a cheap opening round per cell.
+
+    Returns:
+        np.ndarray of shape (len(attack_counts), len(defense_counts), 5),
+        holding (win_chance, tie_chance, loss_chance, avg_attack_loss, avg_defense_loss) for every cell
+    """
+    def with_count(army, troop, count):
+        if troop is None or count is None:
+            return army
+        r = army + Army(army.owner)
+        r[troop] = count
+        return r
+
+    attack_armies = {a : with_count(attacking_army, attack_troop, count) for a, count in enumerate(attack_counts)}
+    defense_armies = {d : with_count(defending_army, defense_troop, count) for d, count in enumerate(defense_counts)}
+    attack_balls = {a : CasualtyBall(army, attacker=True, loss_order=attack_loss_order, need_conquer=need_conquer) for a, army in attack_armies.items()}
+    defense_balls = {d : CasualtyBall(army, attacker=False, loss_order=defense_loss_order, need_conquer=False) for d, army in defense_armies.items()}
+
+    # the number of AA shots is a separate dimension of the chain, so only battles with equal shots can share
+    aa = {(a, d) : calculator.aa_shots(attack_armies[a], defense_armies[d]) for a in attack_armies for d in defense_armies}
+
+    row_cache = {}
+    def cached_rows(key, make):
+        if key not in row_cache:
+            row_cache[key] = make()
+        return row_cache[key]
+
+    defense_groups = share_chains(defense_balls, lambda d: cached_rows(("d", d), lambda: defense_rows(defense_balls[d])))
+    attack_groups = {}
+    for aa_dice in set(aa.values()):
+        balls = {a : attack_balls[a] for a in attack_armies if aa_dice in [aa[(a, d)] for d in defense_armies]}
+        attack_groups[aa_dice] = share_chains(balls, lambda a: cached_rows(("a", a, aa_dice), lambda: attack_rows(attack_balls[a], aa_dice)))
+
+    chains = {}
+    grid = np.zeros((len(attack_armies), len(defense_armies), 5))
+    for (a, d), aa_dice in aa.items():
+        big_a, offset_a = attack_groups[aa_dice][a]
+        big_d, offset_d = defense_groups[d]
+        if (big_a, big_d, aa_dice) not in chains:
+            ball_a, ball_d = attack_balls[big_a], defense_balls[big_d]
+            terminal = terminal_values(ball_a, ball_d, aa_dice)
+            chains[(big_a, big_d, aa_dice)] = calculator.backward_values(ball_a, ball_d, aa_dice, terminal)
+
+        opening = calculator.opening_round(attack_armies[a], attack_balls[a], defense_armies[d], defense_balls[d])
+        value = calculator.opening_value(opening, chains[(big_a, big_d, aa_dice)], attack_balls[a].combatants, defense_balls[d].combatants, offset=(offset_a, offset_d))
+        grid[a, d] = battle_result(value, attack_balls[a], defense_balls[d])
+
+    return grid
+
+def optimal_retreat(attacking_army, defense, need_conquer=True, objective="ipc", win_value=0,
+                    attack_loss_order="IATFB", defense_loss_order="GIABTF"):
+    """
+        Finds, for every state of a land battle, whether the attacker should press on or retreat.
+
+        Uses one backward sweep over the casualty classes: a state's value is the better of retreating
+        right there and the expected value of fighting one more round, so every retreat threshold is
+        considered at once. The attacker decides after each round, starting after the opening round.
+
+    Args:
+        objective (str): "ipc" maximizes the expected IPC swing (defense loss - attack loss, plus win_value on a win),
+            "win" maximizes the win chance, breaking ties by IPC swing.
+        win_value (float): IPC worth of taking the territory, for the "ipc" objective
+
+    Returns:
+        (policy, stats) where policy maps every non-terminal state (h1, h2, a) to True if the attacker should retreat,
+        and stats is (win_chance, tie_chance, loss_chance, retreat_chance, avg_attack_loss, avg_defense_loss)
+        when following the policy.
+    """
+    if isinstance(defense, list):
+       defending_army = sum(defense) # sum all defending armies
+    else:
+        defending_army = defense
+
+    attack_ball = CasualtyBall(attacking_army, attacker=True, loss_order=attack_loss_order, need_conquer=need_conquer)
+    defense_ball = CasualtyBall(defending_army, attacker=False, loss_order=defense_loss_order, need_conquer=False)
+    aa_dice = calculator.aa_shots(attacking_army, defending_army)
+
+    # same as terminal_values, with a retreat chance inserted: (win, tie, loss, retreat, attack IPC left, defense IPC left)
+    terminal = np.insert(terminal_values(attack_ball, defense_ball, aa_dice), 3, 0, axis=3)
+
+    # IPC swing is linear in those values, the constant original army values don't change the decision
+    swing = np.array([win_value, 0, 0, 0, 1, -1])
+    if objective == "ipc":
+        weights, tiebreak = swing, None
+    elif objective == "win":
+        weights, tiebreak = np.array([1, 0, 0, 0, 0, 0]), swing
+    else:
+        raise ValueError(f"Unknown retreat objective {objective}")
+
+    defense_left = [defense_ball.remaining_troops(j).value() for j in range(defense_ball.combatants + 1)]
+    policy = {}
+    def decide(state, press_on):
+        i, j, k = state
+        retreat = np.array([0, 0, 0, 1, attack_ball.remaining_troops(i, k).value(), defense_left[j]])
+        diff = weights @ retreat - weights @ press_on
+        if abs(diff) <= 1e-12 and tiebreak is not None:
+            diff = tiebreak @ retreat - tiebreak @ press_on
+        policy[state] = diff > 1e-12 # only retreat when it is strictly better
+        return retreat if policy[state] else press_on
+
+    values = calculator.backward_values(attack_ball, defense_ball, aa_dice, terminal, decide=decide)
+    opening = calculator.opening_round(attacking_army, attack_ball, defending_army, defense_ball)
+    win_chance, tie_chance, loss_chance, retreat_chance, attack_left, defense_left = calculator.opening_value(
+        opening, values, attack_ball.combatants, defense_ball.combatants
+    )
+    stats = (
+        win_chance, tie_chance, loss_chance, retreat_chance,
+        attack_ball.combatant_values - attack_left, defense_ball.combatant_values - defense_left
+    )
+
+    return policy, stats
+
+def land_battle_rounds(attacking_army, defense, need_conquer=True, attack_loss_order="IATFB", defense_loss_order="GIABTF",
+                       tolerance=1e-9, max_rounds=None):
+    """
+        Generator over the rounds of a land battle, for rules and UI that care about timing
+        (blitzing, attacking for two rounds then retreating, progress bars).
+
+    Yields:
+        (round number, states, (win_chance, tie_chance, loss_chance, ongoing_chance)) after every round,
+        where states is the distribution of (h1, h2, a) states as in calculator.calculate_full_battle
+    """
+    if isinstance(defense, list):
+       defending_army = sum(defense) # sum all defending armies
+    else:
+        defending_army = defense
+
+    attack_ball = CasualtyBall(attacking_army, attacker=True, loss_order=attack_loss_order, need_conquer=need_conquer)
+    defense_ball = CasualtyBall(defending_army, attacker=False, loss_order=defense_loss_order, need_conquer=False)
+    n = attack_ball.combatants
+    m = defense_ball.combatants
+
+    rounds = calculator.battle_rounds(attacking_army, attack_ball, defending_army, defense_ball, tolerance=tolerance, max_rounds=max_rounds)
+    for round_number, states in enumerate(rounds, start=1):
+        win_chance, tie_chance, loss_chance, ongoing_chance = 0, 0, 0, 0
+        for (offense_casualties, defense_casualties, aa_hits), prob in states.items():
+            if offense_casualties + aa_hits >= n and defense_casualties == m:
+                tie_chance += prob
+            elif offense_casualties + aa_hits >= n:
+                loss_chance += prob
+            elif defense_casualties == m:
+                win_chance += prob
+            elif calculator.stalemate(attack_ball, defense_ball, offense_casualties, defense_casualties, aa_hits):
+                loss_chance += prob # neither side can hit anything, the attacker doesn't take the territory
+            else:
+                ongoing_chance += prob
+        yield round_number, states, (win_chance, tie_chance, loss_chance, ongoing_chance)
+
+def amphibious_assault(fleet_army, sea_defense, landing_army, land_defense, need_conquer=True, cargo_order="IAT",
+                       sea_attack_loss_order="DFCBKWN", sea_defense_loss_order="DNCFKW",
+                       attack_loss_order="IATFB", defense_loss_order="GIABTF"):
+    """
+        Calculates an amphibious assault: a sea battle, then a land battle fought by whatever the sea battle left.
+
+        The full distribution of naval outcomes is kept. Outcomes are merged by what they leave for the landing
+        (surviving cruisers, battleships and transports), and the land battles of those merged outcomes share their
+        markov chains: bombardment only changes the opening round, and armies that only differ by cargo lost first
+        share a sweep (see share_chains).
+
+    Args:
+        fleet_army (troop.Army): attacking ships and planes, transports included
+        landing_army (troop.Army): land units carried on the transports, two per transport
+        cargo_order (str): order the cargo is packed in, the first units ride on the transports lost first
+        sea_attack_loss_order (str): see sea_battle, transports go last by default since each one sunk takes its cargo along
+
+    Returns:
+        (win_chance, tie_chance, loss_chance, avg_attack_loss, avg_defense_loss) for taking the territory,
+        where loss_chance includes failing at sea. Losses cover both phases, cargo sunk with its transports included.
+    """
+    if isinstance(sea_defense, list):
+        sea_defense = sum(sea_defense)
+    if isinstance(land_defense, list):
+        land_defense = sum(land_defense)
+
+    sea_attack, sea_defense = fleet(fleet_army), fleet(sea_defense)
+    attack_ball = NavalCasualtyBall(sea_attack, attacker=True, loss_order=sea_attack_loss_order)
+    defense_ball = NavalCasualtyBall(sea_defense, attacker=False, loss_order=sea_defense_loss_order)
+
+    cargo = [LOSS_ORDER_TROOP[c] for c in cargo_order for _ in range(landing_army[LOSS_ORDER_TROOP[c]])]
+    if len(cargo) > 2 * sea_attack[Troop.trans]:
+        raise ValueError(f"{len(cargo)} land units don't fit on {sea_attack[Troop.trans]} transports")
+    cargo_value = sum(TROOP_IPC_VALUE[troop] for troop in cargo)
+
+    # first, the sea battle. Merge its outcomes by what they leave for the landing.
+    states = calculator.calculate_full_battle(sea_attack, attack_ball, sea_defense, defense_ball)
+    n, m = attack_ball.combatants, defense_ball.combatants
+    landings = {} # (cruisers, battleships, transports) -> probability
+    loss_chance = 0
+    avg_attack_loss, avg_defense_loss = 0, 0
+    for (offense_casualties, defense_casualties, _), prob in states.items():
+        over = offense_casualties >= n or defense_casualties >= m
+        if prob == 0 or not (over or calculator.stalemate(attack_ball, defense_ball, offense_casualties, defense_casualties)):
+            continue # skip non-terminal states, a stalemate ends the sea battle with both fleets afloat
+        a = attack_ball.remaining_troops(offense_casualties) if offense_casualties < n else Army(None)
+        d = defense_ball.remaining_troops(defense_casualties) if defense_casualties < m else Army(None)
+        avg_attack_loss += prob * (attack_ball.combatant_values - a.value())
+        avg_defense_loss += prob * (defense_ball.combatant_values - d.value())
+
+        aboard = min(len(cargo), 2 * a[Troop.trans]) # cargo on the transports still afloat
+        avg_attack_loss += prob * (cargo_value - sum(TROOP_IPC_VALUE[troop] for troop in cargo[len(cargo) - aboard:]))
+        landed = aboard if defense_casualties == m else 0
+        if landed == 0: # the fleet didn't win, or nothing made it ashore
+            loss_chance += prob
+            continue
+        key = (a[Troop.cruiser], a[Troop.battleship], landed)
+        landings[key] = landings.get(key, 0.0) + prob
+
+    # then, the land battle for every distinct landing
+    land_armies = {}
+    for key in landings:
+        cruisers, battleships, landed = key
+        army = Army(fleet_army.owner)
+        for troop in cargo[len(cargo) - landed:]:
+            army[troop] += 1
+        army[Troop.cruiser], army[Troop.battleship] = cruisers, battleships # shore bombardment
+        land_armies[key] = army
+
+    land_ball = CasualtyBall(land_defense, attacker=False, loss_order=defense_loss_order, need_conquer=False)
+    land_balls = {key : CasualtyBall(army, attacker=True, loss_order=attack_loss_order, need_conquer=need_conquer) for key, army in land_armies.items()}
+    aa_dice = 0 # landed cargo has no planes for AA to shoot at
+    groups = share_chains(land_balls, lambda key: attack_rows(land_balls[key], aa_dice))
+
+    chains = {}
+    win_chance, tie_chance = 0, 0
+    for key, prob in landings.items():
+        big, offset = groups[key]
+        if big not in chains:
+            terminal = terminal_values(land_balls[big], land_ball, aa_dice)
+            chains[big] = calculator.backward_values(land_balls[big], land_ball, aa_dice, terminal)
+        opening = calculator.opening_round(land_armies[key], land_balls[key], land_defense, land_ball)
+        value = calculator.opening_value(opening, chains[big], land_balls[key].combatants, land_ball.combatants, offset=(offset, 0))
+        win, tie, loss, attack_loss, defense_loss = battle_result(value, land_balls[key], land_ball)
+
+        win_chance += prob * win
+        tie_chance += prob * tie
+        loss_chance += prob * loss
+        avg_attack_loss += prob * attack_loss
+        avg_defense_loss += prob * defense_loss
+
+    return win_chance, tie_chance, loss_chance, avg_attack_loss, avg_defense_loss
+
+def army_key(army):
+    # hashable summary of an army, for caching and for telling whether an army changed
+    return tuple(army[troop] for troop in Troop)
+
+def key_army(key, owner=None):
+    r = Army(owner)
+    for troop, cnt in zip(Troop, key):
+        r[troop] = cnt
+    return r
+
+def outcome_distribution(attacking_army, defense, need_conquer=True, win_value=0, attack_loss_order="IATFB", defense_loss_order="GIABTF"):
+    """
+        Computes the full distribution of a land battle's IPC swing (defense loss - attack loss, plus win_value on a win).
+        win_value must be a whole number of IPCs, the swings are indices into the distribution.
+
+    Returns:
+        (lowest swing, probability of every swing from the lowest up, win_chance), the probabilities are read only
+    """
+    if isinstance(defense, list):
+       defending_army = sum(defense) # sum all defending armies
+    else:
+        defending_army = defense
+
+    if win_value != int(win_value):
+        raise ValueError(f"win_value must be a whole number of IPCs, got {win_value}")
+
+    return _outcome_distribution(army_key(attacking_army), army_key(defending_army), need_conquer, int(win_value), attack_loss_order, defense_loss_order)
+
+@lru_cache(maxsize=None)
+def _outcome_distribution(attack_key, defense_key, need_conquer, win_value, attack_loss_order, defense_loss_order):
+    # cached on the armies, so the same matchup in many turns is only solved once
+    attacking_army, defending_army = key_army(attack_key), key_army(defense_key)
+    attack_ball = CasualtyBall(attacking_army, attacker=True, loss_order=attack_loss_order, need_conquer=need_conquer)
+    defense_ball = CasualtyBall(defending_army, attacker=False, loss_order=defense_loss_order, need_conquer=False)
+    states = calculator.calculate_full_battle(attacking_army, attack_ball, defending_army, defense_ball)
+    n, m = attack_ball.combatants, defense_ball.combatants
+
+    swings = {}
+    win_chance = 0
+    for (offense_casualties, defense_casualties, aa_hits), prob in states.items():
+        if offense_casualties + aa_hits < n and defense_casualties < m:
+            continue # skip non-terminal states
+        attack_left = attack_ball.remaining_troops(offense_casualties, aa_hits).value() if offense_casualties + aa_hits < n else 0
+        defense_left = defense_ball.remaining_troops(defense_casualties).value() if defense_casualties < m else 0
+        swing = (defense_ball.combatant_values - defense_left) - (attack_ball.combatant_values - attack_left)
+        if defense_casualties == m and offense_casualties + aa_hits < n:
+            swing += win_value
+            win_chance += prob
+        swings[swing] = swings.get(swing, 0.0) + prob
+
+    low = min(swings)
+    pmf = np.zeros(max(swings) - low + 1)
+    for swing, prob in swings.items():
+        pmf[swing - low] += prob
+    pmf.setflags(write=False) # shared by every caller through the cache
+
+    return low, pmf, win_chance
+
+def convolve_pmf(pmf1, pmf2, fft_threshold=4096):
+    """
+        Distribution of the sum of two independent integer variables.
+        Large distributions are convolved with an FFT, which can leave tiny negative values, so those are clipped.
+    """
+    if len(pmf1) * len(pmf2) <= fft_threshold:
+        return np.convolve(pmf1, pmf2)
+    return np.clip(fftconvolve(pmf1, pmf2), 0, None)
+
+def power_pmf(pmf, times, fft_threshold=4096):
+    # distribution of the sum of times independent copies, by repeated squaring
+    result = np.ones(1)
+    while times:
+        if times & 1:
+            result = convolve_pmf(result, pmf, fft_threshold)
+        times >>= 1
+        if times:
+            pmf = convolve_pmf(pmf, pmf, fft_threshold)
+    return result
+
+class TurnOutcome:
+    """
+        Joint outcome of a turn of independent battles: the distribution of the total IPC swing,
+        and of the number of battles won.
+    """
+    def __init__(self, swing_low, swing_pmf, wins_pmf):
+        self.swing_low = swing_low
+        self.swing_pmf = swing_pmf
+        self.wins_pmf = wins_pmf
+
+    def swings(self):
+        return np.arange(self.swing_low, self.swing_low + len(self.swing_pmf))
+
+    def expected_swing(self):
+        return float(self.swings() @ self.swing_pmf)
+
+    def prob_swing_at_least(self, swing):
+        return float(self.swing_pmf[max(0, int(np.ceil(swing)) - self.swing_low):].sum())
+
+    def prob_at_least(self, k):
+        # probability that at least k of the battles are won
+        return float(self.wins_pmf[max(0, k):].sum())
+
+def turn_outcome(battles, fft_threshold=4096):
+    """
+        Combines the outcome distributions of several independent battles.
+
+    Args:
+        battles (list): (attacking_army, defense) or (attacking_army, defense, kwargs) tuples, where kwargs
+            are passed on to outcome_distribution (need_conquer, win_value, loss orders)
+        fft_threshold (int): convolutions bigger than this (in multiplications) use an FFT
+
+    Returns:
+        TurnOutcome
+    """
+    # identical matchups are solved once and combined by repeated squaring
+    matchups = {}
+    for battle in battles:
+        attacking_army, defense = battle[:2]
+        kwargs = battle[2] if len(battle) > 2 else {}
+        dist = outcome_distribution(attacking_army, defense, **kwargs)
+        key = (dist[0], dist[1].tobytes(), dist[2])
+        matchups[key] = (dist, matchups.get(key, (dist, 0))[1] + 1)
+
+    swing_low, swing_pmf, wins_pmf = 0, np.ones(1), np.ones(1)
+    for (low, pmf, win_chance), times in matchups.values():
+        swing_low += low * times
+        swing_pmf = convolve_pmf(swing_pmf, power_pmf(pmf, times, fft_threshold), fft_threshold)
+        wins_pmf = convolve_pmf(wins_pmf, power_pmf(np.array([1 - win_chance, win_chance]), times, fft_threshold), fft_threshold)
+
+    return TurnOutcome(swing_low, swing_pmf, wins_pmf)
+
+def optimize_loss_order(attacking_army, defense, side="attack", objective="win", need_conquer=True,
+                        attack_loss_order="IATFB", defense_loss_order="GIABTF"):
+    """
+        Searches the loss orders of one side for the one that maximizes its win chance ("win")
+        or minimizes its average IPC loss ("ipc"). The other side keeps its given loss order.
+
+        Everything that doesn't depend on the searched order is built once: the other side's casualty ball,
+        the opening round dice, and the hit distributions, which are cached on the hitter tuples from
+        remaining_hits. Orders that give identical casualty balls are only solved once. The search is a
+        depth first search over order prefixes with two kinds of pruning:
+            - a troop is never lost before a troop it dominates (hits at least as well and costs at least as much),
+            - for "win" without AA, the best completion of a prefix is losing the weakest dice first, so its
+              value bounds the whole subtree.
+
+    Returns:
+        (best loss order, land_battle result with that order)
+    """
+    if isinstance(defense, list):
+       defending_army = sum(defense) # sum all defending armies
+    else:
+        defending_army = defense
+
+    attacker = side == "attack"
+    army = attacking_army if attacker else defending_army
+    base_order = attack_loss_order if attacker else defense_loss_order
+    HIT_DIE = ATTACK_HIT_DIE if attacker else DEFENSE_HIT_DIE
+    aa_dice = calculator.aa_shots(attacking_army, defending_army)
+
+    def make_ball(order, is_attacker):
+        if is_attacker:
+            return CasualtyBall(attacking_army, attacker=True, loss_order=order, need_conquer=need_conquer)
+        return CasualtyBall(defending_army, attacker=False, loss_order=order, need_conquer=False)
+
+    fixed_ball = make_ball(defense_loss_order if attacker else attack_loss_order, not attacker)
+
+    def score(result):
+        win_chance, tie_chance, loss_chance, avg_attack_loss, avg_defense_loss = result
+        if objective == "win":
+            return win_chance if attacker else 1 - win_chance
+        elif objective == "ipc":
+            return -avg_attack_loss if attacker else -avg_defense_loss
+        raise ValueError(f"Unknown loss order objective {objective}")
+
+    solved = {} # casualty ball signature -> result
+    def evaluate(order):
+        ball = make_ball(order, attacker)
+        signature = tuple(attack_rows(ball, aa_dice) if attacker else defense_rows(ball))
+        if signature not in solved:
+            attack_ball, defense_ball = (ball, fixed_ball) if attacker else (fixed_ball, ball)
+            solved[signature] = solve_battle(attacking_army, attack_ball, defending_army, defense_ball)
+        return solved[signature]
+
+    present = [c for c in base_order if army[LOSS_ORDER_TROOP[c]] > 0]
+    absent = "".join(c for c in base_order if c not in present) # order of missing troops doesn't matter
+    strength = {c : (HIT_DIE[LOSS_ORDER_TROOP[c]], TROOP_IPC_VALUE[LOSS_ORDER_TROOP[c]]) for c in present}
+
+    def dominates(c1, c2):
+        (die1, value1), (die2, value2) = strength[c1], strength[c2]
+        return die1 >= die2 and value1 >= value2 and (die1, value1) != (die2, value2)
+
+    use_bound = objective == "win" and aa_dice == 0
+    best = [None, None, float("-inf")] # order, result, score
+
+    def consider(order):
+        result = evaluate(order)
+        if score(result) > best[2] + 1e-12:
+            best[0], best[1], best[2] = order, result, score(result)
+        return score(result)
+
+    def search(prefix, rest):
+        if not rest:
+            consider(prefix + absent)
+            return
+        if use_bound:
+            # losing the weakest dice first keeps the most firepower at every casualty count
+            bound = consider(prefix + "".join(sorted(rest, key=lambda c: strength[c])) + absent)
+            if bound < best[2] - 1e-12:
+                return
+        for c in rest:
+            others = [r for r in rest if r != c]
+            if any(dominates(c, r) for r in others):
+                continue # c is better in every way than something still standing, lose that first
+            if any(strength[c] == strength[r] and r < c for r in others):
+                continue # interchangeable troops, only try one of their orders
+            search(prefix + c, "".join(others))
+
+    search("", "".join(present))
+    return best[0], best[1]
+
+class IncrementalBattle:
+    """
+        A land battle that is solved again cheaply when a few units join or leave either side,
+        like one more tank attacking or a defender lost in an earlier battle.
+
+        The battle is solved with the backward sweep of solve_battle, and the value of every state is kept.
+        A state's value only depends on the rows of both sides from that state on (see attack_rows), so after
+        a change every state whose rows still line up with the old battle's, shifted by the change in
+        combatants, keeps its old value and only the rest is swept again. Units lost first are the best case,
+        adding an infantry leaves all but one row of states untouched.
+
+        result holds (win_chance, tie_chance, loss_chance, avg_attack_loss, avg_defense_loss) as in land_battle,
+        and reused the share of states whose value was kept by the last solve.
+    """
+    def __init__(self, attacking_army, defense, need_conquer=True, attack_loss_order="IATFB", defense_loss_order="GIABTF"):
+        if isinstance(defense, list):
+            defending_army = sum(defense) # sum all defending armies
+        else:
+            defending_army = defense
+
+        self.attacking_army = attacking_army + Army(attacking_army.owner) # copies, units are added and removed in place
+        self.defending_army = defending_army + Army(defending_army.owner)
+        self.need_conquer = need_conquer
+        self.attack_loss_order = attack_loss_order
+        self.defense_loss_order = defense_loss_order
+
+        self.attack_rows, self.defense_rows, self.values = None, None, None
+        self.reused = 0.0
+        self.result = self.solve()
+
+    def add_units(self, side, troop, count=1):
+        """
+            Adds count troops to the "attack" or "defense" side and solves the battle again.
+
+        Returns:
+            (win_chance, tie_chance, loss_chance, avg_attack_loss, avg_defense_loss)
+        """
+        army = self.attacking_army if side == "attack" else self.defending_army
+        if army[troop] + count < 0:
+            raise ValueError(f"Can't remove {-count} {troop.name} from {side}, only {army[troop]} left")
+        army[troop] += count
+        self.result = self.solve()
+        return self.result
+
+    def remove_units(self, side, troop, count=1):
+        # same as add_units, but takes the troops away
+        return self.add_units(side, troop, -count)
+
+    def solve(self):
+        attack_ball = CasualtyBall(self.attacking_army, attacker=True, loss_order=self.attack_loss_order, need_conquer=self.need_conquer)
+        defense_ball = CasualtyBall(self.defending_army, attacker=False, loss_order=self.defense_loss_order, need_conquer=False)
+        n, m = attack_ball.combatants, defense_ball.combatants
+        aa_dice = calculator.aa_shots(self.attacking_army, self.defending_army)
+        new_attack_rows, new_defense_rows = attack_rows(attack_ball, aa_dice), defense_rows(defense_ball)
+
+        values = terminal_values(attack_ball, defense_ball, aa_dice)
+
+        # a change in AA shots changes the opening round of every state, so only the same shots are worth comparing
+        known = None
+        if self.values is not None and self.values.shape[2] == aa_dice + 1:
+            old_n, old_m = len(self.attack_rows) - 1, len(self.defense_rows) - 1
+            da, dd = n - old_n, m - old_m
+            j0 = self.first_shared_row(self.defense_rows, new_defense_rows, dd)
+            i0s = [self.first_shared_row([row[k] for row in self.attack_rows], [row[k] for row in new_attack_rows], da) for k in range(aa_dice + 1)]
+            if j0 is not None and any(i0 is not None for i0 in i0s):
+                known = np.zeros((n + 1, m + 1, aa_dice + 1), dtype=bool)
+                for k, i0 in enumerate(i0s):
+                    if i0 is not None:
+                        values[i0 + da:, j0 + dd:, k] = self.values[i0:, j0:, k]
+                        known[i0 + da:, j0 + dd:, k] = True
+
+        # nothing to reuse is a plain sweep, without checking every state for a known value
+        self.values = calculator.backward_values(attack_ball, defense_ball, aa_dice, values, known=known)
+        self.attack_rows, self.defense_rows = new_attack_rows, new_defense_rows
+        self.reused = known.mean() if known is not None else 0.0
+
+        opening = calculator.opening_round(self.attacking_army, attack_ball, self.defending_army, defense_ball)
+        return battle_result(calculator.opening_value(opening, self.values, n, m), attack_ball, defense_ball)
+
+    @staticmethod
+    def first_shared_row(old_rows, new_rows, offset):
+        # first old row from which on every old row r equals new row r + offset, or None if not even the last one does
+        first = None
+        for r in range(len(old_rows) - 1, max(0, -offset) - 1, -1):
+            if old_rows[r] != new_rows[r + offset]:
+                break
+            first = r
+        return first
+
 def test_simple_battle():
     a1 = Army(Power.US)
     a1[Troop.inf] += 13
@@ -0,0 +1,70 @@
+"""
+    A file for testing the functionality of accuracy.py
+"""
+import unittest
+import sys
+sys.path.append('..')
+
+from accuracy import accuracy_report, differential_report, monte_carlo_battle, monte_carlo_z, exact_battle, exact_sea_battle, ENGINES, REPORT_BATTLES, FIELDS
+from troop import Troop, Army, Power
+
+class Accuracy(unittest.TestCase):
+
+    def test_engines_within_tolerance(self):
+        report = accuracy_report(battles=REPORT_BATTLES[:4])
+        for precision, stats in report.items():
+            self.assertTrue(stats["within_tolerance"], precision)
+            self.assertEqual(set(stats["max_error"]), set(FIELDS))
+
+    def test_differential(self):
+        report = differential_report(count=40, seed=1, samples=5000, monte_carlo_count=10)
+        for engine in list(ENGINES) + ["monte_carlo"]:
+            self.assertTrue(report[engine]["within_tolerance"], (engine, report[engine]["failures"]))
+            self.assertEqual(set(report[engine]["max_error"]), set(FIELDS))
+            self.assertGreater(report[engine]["throughput"], 0)
+
+    def test_monte_carlo(self):
+        # one infantry each: the attacker wins on (1/6 * 4/6) / (1 - 5/6 * 4/6) = 0.25 and ties on 0.125
+        a1 = Army(Power.US)
+        a1[Troop.inf] += 1
+        a2 = Army(Power.G)
+        a2[Troop.inf] += 1
+        result, standard_error = monte_carlo_battle(a1, a2, samples=40000, seed=0)
+        self.assertLess(abs(result[0] - 0.25), 5 * standard_error[0])
+        self.assertLess(abs(result[1] - 0.125), 5 * standard_error[1])
+
+    def test_monte_carlo_rules(self):
+        # artillery lost first stops supporting, the tank is kept for last
+        a1 = Army(Power.US)
+        a1[Troop.inf] += 3
+        a1[Troop.art] += 2
+        a1[Troop.tank] += 1
+        a1[Troop.fighter] += 1
+        a2 = Army(Power.G)
+        a2[Troop.inf] += 5
+        a2[Troop.aa] += 1
+        options = {"need_conquer" : True, "attack_loss_order" : "AFITB", "defense_loss_order" : "IGABTF"}
+        result, standard_error = monte_carlo_battle(a1, a2, samples=40000, seed=0, **options)
+        self.assertLess(max(monte_carlo_z(result, exact_battle(a1, a2, **options), standard_error, 40000, a1, a2)), 5)
+
+        # a battleship takes two hits, fighters without a carrier are lost
+        a1 = Army(Power.UK)
+        a1[Troop.battleship] += 1
+        a1[Troop.trans] += 1
+        a2 = Army(Power.J)
+        a2[Troop.cruiser] += 1
+        a2[Troop.carrier] += 1
+        a2[Troop.fighter] += 3
+        options = {"attack_loss_order" : "DNW", "defense_loss_order" : "DKCFW"}
+        result, standard_error = monte_carlo_battle(a1, a2, "sea", samples=40000, seed=0, **options)
+        self.assertLess(max(monte_carlo_z(result, exact_sea_battle(a1, a2, **options), standard_error, 40000, a1, a2)), 5)
+
+        # transports against transports, nobody can hit anything
+        a2 = Army(Power.J)
+        a2[Troop.trans] += 2
+        a1[Troop.battleship] -= 1
+        result, standard_error = monte_carlo_battle(a1, a2, "sea", samples=1000, seed=0)
+        self.assertEqual(result, (0, 0, 1, 0, 0))
+
+if __name__ == '__main__':
+    unittest.main()
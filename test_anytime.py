@@ -0,0 +1,61 @@
+"""
+    A file for testing the functionality of anytime.py
+"""
+import unittest
+import sys
+sys.path.append('..')
+import asyncio
+from time import perf_counter
+
+from troop import Troop, Army, Power
+from simulator import land_battle
+from anytime import AnytimeBattle, land_battle_async, land_battle_updates
+
+class Anytime(unittest.TestCase):
+
+    def setUp(self):
+        self.a1 = Army(Power.US)
+        self.a1[Troop.inf] += 4
+        self.a1[Troop.tank] += 2
+        self.a1[Troop.fighter] += 1
+        self.a2 = Army(Power.G)
+        self.a2[Troop.inf] += 5
+        self.a2[Troop.aa] += 1
+
+    def test_estimates_within_bound(self):
+        exact = land_battle(self.a1, self.a2)
+        estimates = []
+        best = AnytimeBattle(self.a1, self.a2, report_interval=0).run(callback=estimates.append)
+
+        self.assertTrue(best.exact)
+        for r, ref in zip(best.result, exact):
+            self.assertAlmostEqual(r, ref, places=9)
+        bounds = [estimate.error_bound for estimate in estimates]
+        self.assertEqual(bounds, sorted(bounds, reverse=True))
+        for estimate in estimates:
+            for r, ref in zip(estimate.result[:3], exact[:3]):
+                self.assertLessEqual(abs(r - ref), estimate.error_bound + 1e-12)
+
+    def test_updates_end_exact(self):
+        async def collect():
+            return [estimate async for estimate in land_battle_updates(self.a1, self.a2)]
+        estimates = asyncio.run(collect())
+        self.assertTrue(estimates[-1].exact)
+        self.assertEqual(estimates[-1].error_bound, 0)
+
+    def test_deadline(self):
+        # a battle far too large to finish in the budget still answers on time
+        a1 = Army(Power.R)
+        a1[Troop.inf] += 60
+        a1[Troop.tank] += 30
+        a2 = Army(Power.G)
+        a2[Troop.inf] += 80
+        a2[Troop.art] += 20
+        start = perf_counter()
+        estimate = asyncio.run(land_battle_async(a1, a2, timeout=0.2))
+        self.assertLess(perf_counter() - start, 2)
+        self.assertFalse(estimate.exact)
+        self.assertGreater(estimate.error_bound, 0)
+
+if __name__ == '__main__':
+    unittest.main()
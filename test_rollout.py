@@ -0,0 +1,76 @@
+"""
+    A file for testing the functionality of rollout.py
+"""
+import unittest
+import sys
+sys.path.append('..')
+
+import numpy as np
+
+from troop import Troop, Army, Power
+from simulator import land_battle
+from rollout import simple_setup, RolloutEngine, outcome_table, win_chance, POWER_INDEX, ROLLOUT_TROOPS
+
+class Rollout(unittest.TestCase):
+
+    def test_snapshot_copy_on_write(self):
+        state = simple_setup()
+        child = state.snapshot()
+        self.assertIs(child.units, state.units)
+
+        child.writable("units")[0, 0, 0] += 5
+        self.assertIsNot(child.units, state.units)
+        self.assertEqual(state.units[0, 0, 0] + 5, child.units[0, 0, 0])
+        self.assertIs(child.owner, state.owner) # untouched arrays are still shared
+
+    def test_rollout_leaves_state(self):
+        state = simple_setup()
+        units, owner, ipcs = state.units.copy(), state.owner.copy(), state.ipcs.copy()
+        end = RolloutEngine(seed=1).rollout(state, turns=10)
+
+        self.assertEqual(end.turn, 10)
+        self.assertTrue((state.units == units).all())
+        self.assertTrue((state.owner == owner).all())
+        self.assertTrue((state.ipcs == ipcs).all())
+        self.assertTrue((end.units >= 0).all())
+        self.assertTrue((end.ipcs >= 0).all())
+
+    def test_outcome_table(self):
+        cumulative, attack_left, defense_left, won = outcome_table((3, 1, 2, 0), (4, 0, 0, 1))
+        self.assertAlmostEqual(cumulative[-1], 1, places=9)
+        self.assertTrue(((attack_left.sum(axis=1) == 0) | (defense_left.sum(axis=1) == 0)).all())
+
+        a1 = Army(Power.G)
+        a1[Troop.inf] += 3
+        a1[Troop.art] += 1
+        a1[Troop.tank] += 2
+        a2 = Army(Power.R)
+        a2[Troop.inf] += 4
+        a2[Troop.aa] += 1
+        self.assertAlmostEqual(win_chance((3, 1, 2, 0), (4, 0, 0, 1)), land_battle(a1, a2)[0], places=6)
+
+    def test_capital_capture(self):
+        state = simple_setup()
+        uk = state.board.index["United Kingdom"]
+        g, us, britain = POWER_INDEX[Power.G], POWER_INDEX[Power.US], POWER_INDEX[Power.UK]
+        ipcs = state.ipcs.copy()
+        units = state.writable("units")
+        units[uk] = 0
+        units[uk, g, ROLLOUT_TROOPS.index(Troop.tank)] = 2
+
+        # Germany takes the UK's capital, and its bank
+        RolloutEngine(seed=0).resolve_battle(state, uk, Power.G)
+        self.assertEqual(state.owner[uk], g)
+        self.assertEqual(state.ipcs[g], ipcs[g] + ipcs[britain])
+        self.assertEqual(state.ipcs[britain], 0)
+
+        # the US liberates it, the UK gets it back and nobody's bank moves
+        units[uk] = 0
+        units[uk, us, ROLLOUT_TROOPS.index(Troop.tank)] = 2
+        ipcs = state.ipcs.copy()
+        RolloutEngine(seed=0).resolve_battle(state, uk, Power.US)
+        self.assertEqual(state.owner[uk], britain)
+        self.assertTrue((state.ipcs == ipcs).all())
+
+if __name__ == '__main__':
+    unittest.main()
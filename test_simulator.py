@@ -4,10 +4,13 @@
 import unittest
 import sys
 sys.path.append('..')
+from itertools import permutations
 
+import numpy as np
 
 from troop import Troop, Army, Power
-from simulator import land_battle
+import calculator
+from simulator import CasualtyBall, NavalCasualtyBall, land_battle, sea_battle, amphibious_assault, turn_outcome, land_battle_grid, optimal_retreat, land_battle_rounds, optimize_loss_order, IncrementalBattle, outcome_distribution
 
 class BasicCalc(unittest.TestCase):
 
@@ -268,5 +271,345 @@ class BulkCalc(unittest.TestCase):
         self.assertAlmostEqual(avg_defense_loss, 96, places=0)
 
 
+class SeaCalc(unittest.TestCase):
+
+    def test_battleship_two_hits(self):
+        a1 = Army(Power.US)
+        a1[Troop.battleship] += 1
+        a2 = Army(Power.G)
+        a2[Troop.cruiser] += 2
+        win_chance, tie_chance, loss_chance, avg_attack_loss, avg_defense_loss = sea_battle(a1, a2)
+        accuracy_decimal = 2
+
+        self.assertAlmostEqual(win_chance, 0.319, places=accuracy_decimal)
+        self.assertAlmostEqual(loss_chance, 0.508, places=accuracy_decimal)
+        self.assertAlmostEqual(tie_chance, 1 - win_chance - loss_chance, places=accuracy_decimal)
+        self.assertAlmostEqual(avg_attack_loss, 13.6, places=0)
+        self.assertAlmostEqual(avg_defense_loss, 16.2, places=0)
+
+    def test_transport_carrier(self):
+        a1 = Army(Power.US)
+        a1[Troop.battleship] += 1
+        a1[Troop.fighter] += 1
+        a1[Troop.inf] += 2 # cargo doesn't fight or get bombard
+        a2 = Army(Power.G)
+        a2[Troop.trans] += 1
+        a2[Troop.carrier] += 1
+        a2[Troop.cruiser] += 1
+        win_chance, tie_chance, loss_chance, avg_attack_loss, avg_defense_loss = sea_battle(a1, a2, attack_loss_order="DFW", defense_loss_order="NKC")
+        accuracy_decimal = 2
+
+        self.assertAlmostEqual(win_chance, 0.647, places=accuracy_decimal)
+        self.assertAlmostEqual(loss_chance, 0.241, places=accuracy_decimal)
+        self.assertAlmostEqual(tie_chance, 1 - win_chance - loss_chance, places=accuracy_decimal)
+        self.assertAlmostEqual(avg_attack_loss, 13.5, places=0)
+        self.assertAlmostEqual(avg_defense_loss, 28.8, places=0)
+
+    def test_stranded_fighters(self):
+        a2 = Army(Power.J)
+        a2[Troop.fighter] += 2
+        a2[Troop.carrier] += 1
+        defense_ball = NavalCasualtyBall(a2, attacker=False, loss_order="KF")
+
+        self.assertEqual(defense_ball.remaining_troops(0)[Troop.fighter], 2)
+        self.assertEqual(defense_ball.remaining_troops(1)[Troop.fighter], 0) # the carrier sank, nowhere to land
+        self.assertEqual(defense_ball.remaining_troops(1).value(), 0)
+
+    def test_battleship_damaged_first(self):
+        a1 = Army(Power.US)
+        a1[Troop.battleship] += 1
+        with self.assertRaises(ValueError):
+            NavalCasualtyBall(a1, attacker=True, loss_order="WD")
+
+    def test_stalemate(self):
+        # transports can't hit each other, the attacker neither wins nor loses anything
+        a1 = Army(Power.US)
+        a1[Troop.trans] += 1
+        a1[Troop.carrier] += 1
+        a2 = Army(Power.G)
+        a2[Troop.trans] += 1
+        win_chance, tie_chance, loss_chance, avg_attack_loss, avg_defense_loss = sea_battle(a1, a2)
+        self.assertEqual((win_chance, tie_chance, loss_chance), (0, 0, 1))
+        self.assertEqual((avg_attack_loss, avg_defense_loss), (0, 0))
+
+        landing = Army(Power.US)
+        landing[Troop.inf] += 2
+        self.assertAlmostEqual(amphibious_assault(a1, a2, landing, Army(Power.G))[2], 1)
+
+class AmphibiousCalc(unittest.TestCase):
+
+    def setUp(self):
+        self.fleet = Army(Power.US)
+        self.fleet[Troop.trans] += 3
+        self.fleet[Troop.battleship] += 1
+        self.fleet[Troop.cruiser] += 1
+        self.fleet[Troop.fighter] += 1
+        self.cargo = Army(Power.US)
+        self.cargo[Troop.inf] += 3
+        self.cargo[Troop.art] += 1
+        self.cargo[Troop.tank] += 2
+        self.land_defense = Army(Power.G)
+        self.land_defense[Troop.inf] += 5
+        self.land_defense[Troop.art] += 1
+
+    def test_unopposed_landing(self):
+        landing = self.cargo + Army(Power.US)
+        landing[Troop.cruiser] += 1
+        landing[Troop.battleship] += 1
+        expected = land_battle(landing, self.land_defense)
+        result = amphibious_assault(self.fleet, Army(Power.G), self.cargo, self.land_defense)
+        for e, actual in zip(expected, result):
+            self.assertAlmostEqual(e, actual, places=9)
+
+    def test_contested_landing(self):
+        sea_defense = Army(Power.G)
+        sea_defense[Troop.cruiser] += 1
+        sea_defense[Troop.fighter] += 1
+        win_chance, tie_chance, loss_chance, avg_attack_loss, avg_defense_loss = amphibious_assault(self.fleet, sea_defense, self.cargo, self.land_defense,
+                                                                                                    sea_attack_loss_order="DNFCBKW")
+        accuracy_decimal = 2
+
+        self.assertAlmostEqual(win_chance + tie_chance + loss_chance, 1, places=9)
+        self.assertAlmostEqual(win_chance, 0.587, places=accuracy_decimal)
+        self.assertAlmostEqual(loss_chance, 0.386, places=accuracy_decimal)
+        self.assertAlmostEqual(avg_attack_loss, 19.7, places=0)
+        self.assertAlmostEqual(avg_defense_loss, 37.4, places=0)
+
+        # by default transports are lost last, so more cargo makes it ashore
+        self.assertGreater(amphibious_assault(self.fleet, sea_defense, self.cargo, self.land_defense)[0], win_chance + 0.1)
+
+class TurnCalc(unittest.TestCase):
+
+    def test_joint_outcome(self):
+        a1 = Army(Power.US)
+        a1[Troop.inf] += 3
+        a1[Troop.tank] += 2
+        a2 = Army(Power.G)
+        a2[Troop.inf] += 3
+        a3 = Army(Power.J)
+        a3[Troop.inf] += 2
+        a4 = Army(Power.UK)
+        a4[Troop.inf] += 1
+        battles = [(a1, a2), (a1, a2), (a3, a4), (a1, a2, {"win_value" : 3})]
+        win_1, _, _, attack_loss_1, defense_loss_1 = land_battle(a1, a2)
+        win_2, _, _, attack_loss_2, defense_loss_2 = land_battle(a3, a4)
+
+        direct = turn_outcome(battles, fft_threshold=10 ** 9)
+        fft = turn_outcome(battles, fft_threshold=0)
+        expected_swing = 3 * (defense_loss_1 - attack_loss_1) + 3 * win_1 + defense_loss_2 - attack_loss_2
+
+        self.assertAlmostEqual(direct.swing_pmf.sum(), 1, places=9)
+        self.assertAlmostEqual(direct.expected_swing(), expected_swing, places=6)
+        self.assertAlmostEqual(fft.expected_swing(), expected_swing, places=6)
+        self.assertAlmostEqual(direct.prob_at_least(0), 1, places=9)
+        self.assertAlmostEqual(direct.prob_at_least(4), win_1 ** 3 * win_2, places=9)
+        self.assertAlmostEqual(fft.prob_at_least(4), win_1 ** 3 * win_2, places=9)
+
+    def test_outcome_distribution_checks(self):
+        a1 = Army(Power.US)
+        a1[Troop.inf] += 2
+        a2 = Army(Power.G)
+        a2[Troop.inf] += 1
+        with self.assertRaises(ValueError):
+            outcome_distribution(a1, a2, win_value=2.5)
+        low, pmf, win_chance = outcome_distribution(a1, a2, win_value=2.0)
+        with self.assertRaises(ValueError):
+            pmf[0] = 1 # the cached distribution can't be changed by a caller
+
+class GridCalc(unittest.TestCase):
+
+    def test_grid_matches_land_battle(self):
+        a1 = Army(Power.US)
+        a1[Troop.art] += 2
+        a1[Troop.tank] += 1
+        a1[Troop.fighter] += 1
+        a1[Troop.battleship] += 1
+        a2 = Army(Power.G)
+        a2[Troop.art] += 1
+        a2[Troop.aa] += 1
+        grid = land_battle_grid(a1, a2, Troop.inf, range(1, 6), Troop.inf, range(1, 5))
+        self.assertEqual(grid.shape, (5, 4, 5))
+
+        for x, attack_inf in enumerate(range(1, 6)):
+            for y, defense_inf in enumerate(range(1, 5)):
+                a1[Troop.inf] = attack_inf
+                a2[Troop.inf] = defense_inf
+                for expected, actual in zip(land_battle(a1, a2), grid[x, y]):
+                    self.assertAlmostEqual(expected, actual, places=9)
+
+    def test_grid_one_axis(self):
+        a1 = Army(Power.J)
+        a1[Troop.inf] += 2
+        a2 = Army(Power.UK)
+        a2[Troop.inf] += 1
+        grid = land_battle_grid(a1, a2, Troop.inf, [2, 10])
+        self.assertEqual(grid.shape, (2, 1, 5))
+        self.assertAlmostEqual(grid[0, 0, 0], 0.677, places=2)
+        self.assertAlmostEqual(grid[1, 0, 0], 0.999, places=2)
+
+class RetreatCalc(unittest.TestCase):
+
+    def test_retreat_improves_swing(self):
+        a1 = Army(Power.US)
+        a1[Troop.inf] += 4
+        a1[Troop.tank] += 2
+        a2 = Army(Power.G)
+        a2[Troop.inf] += 6
+        win_chance, tie_chance, loss_chance, avg_attack_loss, avg_defense_loss = land_battle(a1, a2)
+        policy, stats = optimal_retreat(a1, a2)
+
+        self.assertTrue(any(policy.values()))
+        self.assertAlmostEqual(sum(stats[:4]), 1, places=9)
+        self.assertGreater(stats[5] - stats[4], avg_defense_loss - avg_attack_loss)
+
+    def test_win_objective_never_retreats(self):
+        a1 = Army(Power.R)
+        a1[Troop.inf] += 4
+        a1[Troop.art] += 2
+        a2 = Army(Power.J)
+        a2[Troop.inf] += 6
+        expected = land_battle(a1, a2)
+        policy, stats = optimal_retreat(a1, a2, objective="win")
+
+        self.assertFalse(any(policy.values()))
+        self.assertAlmostEqual(stats[3], 0, places=9)
+        for e, actual in zip(expected, stats[:3] + stats[4:]):
+            self.assertAlmostEqual(e, actual, places=9)
+
+class RoundCalc(unittest.TestCase):
+
+    def test_rounds_converge(self):
+        a1 = Army(Power.US)
+        a1[Troop.inf] += 1
+        a1[Troop.tank] += 1
+        a1[Troop.fighter] += 1
+        a2 = Army(Power.G)
+        a2[Troop.inf] += 3
+        a2[Troop.aa] += 1
+        win_chance, tie_chance, loss_chance, avg_attack_loss, avg_defense_loss = land_battle(a1, a2)
+        rounds = list(land_battle_rounds(a1, a2, tolerance=1e-10))
+
+        self.assertEqual([r[0] for r in rounds], list(range(1, len(rounds) + 1)))
+        for _, states, summary in rounds:
+            self.assertAlmostEqual(sum(states.values()), 1, places=9)
+            self.assertAlmostEqual(sum(summary), 1, places=9)
+        _, _, (win, tie, loss, ongoing) = rounds[-1]
+        self.assertLess(ongoing, 1e-10)
+        self.assertAlmostEqual(win, win_chance, places=8)
+        self.assertAlmostEqual(loss, loss_chance, places=8)
+
+    def test_single_round(self):
+        a1 = Army(Power.J)
+        a1[Troop.inf] += 1
+        a2 = Army(Power.UK)
+        a2[Troop.inf] += 1
+        rounds = list(land_battle_rounds(a1, a2, max_rounds=1))
+        self.assertEqual(len(rounds), 1)
+        _, _, (win, tie, loss, ongoing) = rounds[0]
+        self.assertAlmostEqual(win, 1 / 6 * 4 / 6, places=9)
+        self.assertAlmostEqual(tie, 1 / 6 * 2 / 6, places=9)
+        self.assertAlmostEqual(loss, 5 / 6 * 2 / 6, places=9)
+
+class LossOrderCalc(unittest.TestCase):
+
+    def setUp(self):
+        self.a1 = Army(Power.US)
+        self.a1[Troop.inf] += 2
+        self.a1[Troop.art] += 1
+        self.a1[Troop.tank] += 1
+        self.a1[Troop.fighter] += 1
+        self.a2 = Army(Power.G)
+        self.a2[Troop.inf] += 3
+        self.a2[Troop.tank] += 1
+
+    def test_attack_orders(self):
+        # the pruned search finds the same best value as trying every order
+        for objective, field, sign in [("win", 0, 1), ("ipc", 3, -1)]:
+            order, result = optimize_loss_order(self.a1, self.a2, side="attack", objective=objective)
+            best = max(sign * land_battle(self.a1, self.a2, attack_loss_order="".join(p) + "B")[field] for p in permutations("IATF"))
+            self.assertAlmostEqual(sign * result[field], best, places=9)
+            self.assertAlmostEqual(land_battle(self.a1, self.a2, attack_loss_order=order)[field], result[field], places=9)
+
+    def test_defense_orders(self):
+        order, result = optimize_loss_order(self.a1, self.a2, side="defense", objective="win")
+        best = min(land_battle(self.a1, self.a2, defense_loss_order="GAB" + "".join(p) + "F")[0] for p in permutations("IT"))
+        self.assertAlmostEqual(result[0], best, places=9)
+        self.assertLessEqual(result[0], land_battle(self.a1, self.a2)[0] + 1e-12)
+
+    def test_any_order_with_aa(self):
+        # AA guns take the first planes in the loss order, wherever in the order they are
+        self.a1[Troop.bomber] += 1
+        self.a2[Troop.aa] += 1
+        for p in permutations("IATFB"):
+            order = "".join(p)
+            result = land_battle(self.a1, self.a2, attack_loss_order=order)
+            self.assertAlmostEqual(sum(result[:3]), 1, places=9)
+            for r, ref in zip(land_battle(self.a1, self.a2, attack_loss_order=order, precision="log"), result):
+                self.assertAlmostEqual(r, ref, places=9)
+
+        ball = CasualtyBall(self.a1, attacker=True, loss_order="FBIAT", need_conquer=True)
+        self.assertEqual(ball.remaining_hits(0, 1), (0, 1, 2, 1, 1)) # the fighter was shot down
+        self.assertEqual(ball.remaining_hits(1, 1), (0, 1, 2, 1, 0)) # then the bomber, then the infantry
+        self.assertEqual(ball.remaining_hits(2, 1), (0, 0, 2, 1, 0))
+
+    def test_lost_artillery_stops_support(self):
+        ball = CasualtyBall(self.a1, attacker=True, loss_order="AITFB", need_conquer=True)
+        self.assertEqual(ball.remaining_hits(0), (0, 1, 2, 2, 0))
+        self.assertEqual(ball.remaining_hits(1), (0, 2, 0, 2, 0)) # both infantry hit on a 1 without the artillery
+
+class PrecisionCalc(unittest.TestCase):
+
+    def test_engines_agree(self):
+        a1 = Army(Power.US)
+        a1[Troop.inf] += 3
+        a1[Troop.tank] += 1
+        a1[Troop.bomber] += 1
+        a1[Troop.battleship] += 1
+        a2 = Army(Power.G)
+        a2[Troop.inf] += 4
+        a2[Troop.aa] += 1
+        reference = land_battle(a1, a2)
+        for precision, places in [("float32", 5), ("log", 10)]:
+            result = land_battle(a1, a2, precision=precision)
+            for r, ref in zip(result, reference):
+                self.assertAlmostEqual(r, ref, places=places)
+
+    def test_log_keeps_tiny_hits(self):
+        # 700 bombers all missing is about 1e-334, below the smallest float64
+        log_dist = calculator.log_hit_array((0, 0, 0, 700))
+        self.assertEqual(calculator.pure_hits((0, 0, 0, 700))[0], 0)
+        self.assertAlmostEqual(log_dist[0], 700 * np.log(1 / 3), places=6)
+        self.assertAlmostEqual(np.logaddexp.reduce(log_dist), 0, places=9)
+        self.assertTrue(np.allclose(np.exp(calculator.log_hit_array((2, 1, 3, 1))), calculator.pure_hits((2, 1, 3, 1))))
+
+class IncrementalCalc(unittest.TestCase):
+
+    def test_updates_match_fresh(self):
+        a1 = Army(Power.R)
+        a1[Troop.inf] += 4
+        a1[Troop.tank] += 2
+        a1[Troop.fighter] += 1
+        a2 = Army(Power.G)
+        a2[Troop.inf] += 5
+        a2[Troop.art] += 1
+        a2[Troop.aa] += 1
+        battle = IncrementalBattle(a1, a2)
+
+        for side, troop, change in [("attack", Troop.inf, 1), ("defense", Troop.inf, -2), ("attack", Troop.tank, 1), ("attack", Troop.fighter, 1), ("defense", Troop.aa, -1)]:
+            if change > 0:
+                result = battle.add_units(side, troop, change)
+            else:
+                result = battle.remove_units(side, troop, -change)
+            for r, ref in zip(result, land_battle(battle.attacking_army, battle.defending_army)):
+                self.assertAlmostEqual(r, ref, places=9)
+            if troop == Troop.inf:
+                self.assertGreater(battle.reused, 0.5) # infantry are lost first, so most states are reused
+            if troop in (Troop.fighter, Troop.aa):
+                self.assertEqual(battle.reused, 0.0) # the AA shots changed, so the battle is swept from scratch
+
+        self.assertEqual(a1[Troop.inf], 4) # the original armies are left alone
+        with self.assertRaises(ValueError):
+            battle.remove_units("attack", Troop.fighter, 3)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
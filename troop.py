@@ -22,12 +22,15 @@ class Troop(Enum):
     fighter = 9
     bomber = 10
     supported_inf = 11 # used for internal calculations with infantry hitting on a 2 with artillery
+    damaged_battleship = 12 # used for internal calculations, the first hit a battleship takes without sinking
 
 ATTACK_HIT_DIE = { # hit die for troops on the attack
     Troop.inf : 1,
     Troop.art : 2,
     Troop.tank : 3,
+    Troop.trans : 0,
     Troop.cruiser : 3,
+    Troop.carrier : 0,
     Troop.battleship : 4,
     Troop.fighter : 3,
     Troop.bomber : 4,
@@ -39,7 +42,9 @@ DEFENSE_HIT_DIE = { # hit die for troops on the defense
     Troop.art : 2,
     Troop.tank : 3,
     Troop.aa : 0,
+    Troop.trans : 0,
     Troop.cruiser : 3,
+    Troop.carrier : 2,
     Troop.battleship : 4,
     Troop.fighter : 3,
     Troop.bomber : 4,
@@ -52,7 +57,12 @@ LOSS_ORDER_TROOP = { # map from the character loss order to the Troop enum value
     'F' : Troop.fighter,
     'B' : Troop.bomber,
     'G' : Troop.aa,
-    'S' : Troop.supported_inf
+    'S' : Troop.supported_inf,
+    'N' : Troop.trans,
+    'C' : Troop.cruiser,
+    'K' : Troop.carrier,
+    'W' : Troop.battleship,
+    'D' : Troop.damaged_battleship
 }
 
 TROOP_IPC_VALUE = { # map from Troop enum to their IPC value
@@ -66,7 +76,8 @@ TROOP_IPC_VALUE = { # map from Troop enum to their IPC value
     Troop.battleship : 20,
     Troop.fighter : 10,
     Troop.bomber : 12,
-    Troop.supported_inf : 3
+    Troop.supported_inf : 3,
+    Troop.damaged_battleship : 0 # taking the first hit costs nothing, battleships are repaired after combat
 }
 
 AIR_UNITS = [
@@ -75,10 +86,15 @@ AIR_UNITS = [
 ]
 
 NAVAL_UNITS = [
+    Troop.trans,
     Troop.cruiser,
-    Troop.battleship
+    Troop.carrier,
+    Troop.battleship,
+    Troop.damaged_battleship
 ]
 
+CARRIER_CAPACITY = 2 # fighters that can land on one carrier
+
 class Army:
     def __init__(self, owner):
         self.owner = owner
@@ -117,6 +133,11 @@ class Army:
             r.troops[troop] += self[troop] + other[troop]
         return r
 
+    def __radd__(self, other): # lets sum() start from 0 when adding a list of armies
+        if other == 0:
+            return self + Army(self.owner)
+        return self + other
+
 def main():
     pass
 